@@ -1,14 +1,15 @@
 from datetime import datetime, timedelta
-from uuid import uuid4
+from uuid import UUID, uuid4
 
 import asyncpg
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from app.db import get_db_connection
+from app.auth.hashing import HasherStats, password_hasher
+from app.cache import LRUCache
+from app.db import acquire, get_db_pool, get_read_db_pool, read_or_primary
 from app.settings import settings
 from app.users.models import User, UserIn, UserInDB
 from app.users.queries import get_user_by_username, insert_user
@@ -21,11 +22,21 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str
+    uuid: UUID | None = None
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token/")
+# For routes that also accept other credentials
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="/auth/token/", auto_error=False
+)
+
+# (username, uuid) from token claims -> user, so authenticated requests
+# skip the users lookup. Keyed by uuid too, so a reused username never
+# resolves to another account.
+authenticated_users: LRUCache[tuple[str, UUID], User] = LRUCache(
+    settings.user_cache_size, settings.user_cache_ttl_seconds
+)
 
 router = APIRouter(
     prefix="/auth",
@@ -33,30 +44,30 @@ router = APIRouter(
 )
 
 
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
-
-
 def create_access_token(data: TokenData, expires_delta: timedelta):
     expire = datetime.utcnow() + expires_delta
     to_encode = {"exp": expire, "sub": data.username}
+    if data.uuid is not None:
+        to_encode["uid"] = str(data.uuid)
     return jwt.encode(to_encode, settings.auth_key, algorithm=settings.jwt_alogrithm)
 
 
 async def authenticate_user(
-    conn: asyncpg.Connection, username: str, password: str
+    db: asyncpg.Pool | asyncpg.Connection, username: str, password: str
 ) -> UserInDB | None:
-    user = await get_user_by_username(conn, username)
+    async with acquire(db) as conn:
+        user = await get_user_by_username(conn, username)
     if user is None:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return None
     return user
 
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
+    read_db: asyncpg.Pool = Depends(get_read_db_pool),
 ) -> User:
     incorrect_credentials = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -70,30 +81,44 @@ async def get_current_user(
         username: str | None = payload.get("sub")
         if username is None:
             raise incorrect_credentials
-        token_data = TokenData(username=username)
-    except JWTError:
+        token_data = TokenData(username=username, uuid=payload.get("uid"))
+    except (JWTError, ValidationError):
         raise incorrect_credentials
 
-    user = await get_user_by_username(conn, token_data.username)
+    if token_data.uuid is not None:
+        cached = authenticated_users.get((token_data.username, token_data.uuid))
+        if cached is not None:
+            return cached
+
+    # A just registered user may not be on the replica yet
+    user = await read_or_primary(
+        read_db, db, lambda conn: get_user_by_username(conn, token_data.username)
+    )
     if user is None:
         raise incorrect_credentials
+    if token_data.uuid is not None and token_data.uuid != user.uuid:
+        raise incorrect_credentials
 
-    return User(username=user.username, uuid=user.uuid)
+    current_user = User(username=user.username, uuid=user.uuid)
+    if token_data.uuid is not None:
+        authenticated_users.set((token_data.username, token_data.uuid), current_user)
+    return current_user
 
 
 @router.post("/register/", response_model=User)
 async def register(
     user: UserIn,
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
     user_in_db = UserInDB(
         uuid=uuid4(),
         username=user.username,
-        password_hash=pwd_context.hash(user.password),
+        password_hash=await password_hasher.hash(user.password),
     )
 
     try:
-        await insert_user(conn, user_in_db)
+        async with acquire(db) as conn:
+            await insert_user(conn, user_in_db)
     except asyncpg.UniqueViolationError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -109,9 +134,9 @@ async def register(
 @router.post("/token/", response_model=Token)
 async def token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    user = await authenticate_user(conn, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -122,7 +147,12 @@ async def token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token = create_access_token(
-        TokenData(username=user.username),
+        TokenData(username=user.username, uuid=user.uuid),
         timedelta(minutes=settings.access_token_expires_minutes),
     )
     return Token(access_token=access_token, token_type="bearer")
+
+
+@router.get("/hashing/", response_model=HasherStats)
+async def hashing_stats():
+    return password_hasher.stats()
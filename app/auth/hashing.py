@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from pydantic import BaseModel
+
+from app.settings import settings
+
+T = TypeVar("T")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HasherStats(BaseModel):
+    workers: int
+    max_pending: int
+    pending: int
+    rejected: int
+    saturation: float
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a small thread pool, so hashing never blocks the event
+    loop. At most max_pending calls may wait or run at once, the rest are
+    rejected with 503 instead of queueing up behind a login storm.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor: ThreadPoolExecutor | None = None
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={
+                    "reason": "auth_overloaded",
+                    "message": "Too many concurrent logins, try again later",
+                },
+                headers={"Retry-After": "1"},
+            )
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="password-hasher"
+            )
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, fn, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self.run(pwd_context.verify, plain, hashed)
+
+    def stats(self) -> HasherStats:
+        return HasherStats(
+            workers=self.workers,
+            max_pending=self.max_pending,
+            pending=self.pending,
+            rejected=self.rejected,
+            saturation=self.pending / self.max_pending,
+        )
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+password_hasher = PasswordHasher(
+    settings.password_hash_workers, settings.password_hash_max_pending
+)
@@ -1,28 +1,362 @@
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 from urllib.request import Request
 
 import asyncpg
 from fastapi import Request
+from pydantic import BaseModel
 
 from app.settings import settings
 
+LISTEN_RECONNECT_SECONDS = 5
+LISTEN_MAX_RECONNECT_SECONDS = 60
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats(BaseModel):
+    min_size: int
+    max_size: int
+    size: int
+    in_use: int
+    idle: int
+    # Callers waiting for a connection right now
+    waiting: int
+    acquired: int
+    acquire_wait_seconds_total: float
+
+
+class PoolMetrics:
+    """
+    Acquire counters of a pool, asyncpg only knows how many connections
+    it holds, not how long callers waited for one.
+    """
+
+    def __init__(self):
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_seconds_total = 0.0
+
+    def stats(self, pool: asyncpg.Pool) -> PoolStats:
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        return PoolStats(
+            min_size=pool.get_min_size(),
+            max_size=pool.get_max_size(),
+            size=size,
+            in_use=size - idle,
+            idle=idle,
+            waiting=self.waiting,
+            acquired=self.acquired,
+            acquire_wait_seconds_total=self.wait_seconds_total,
+        )
+
+
+# id(pool) -> metrics, for every pool made by create_pool
+pool_metrics: dict[int, PoolMetrics] = {}
+
+
+async def create_pool(dsn: str) -> asyncpg.Pool:
+    pool = await asyncpg.create_pool(
+        dsn=dsn,
+        min_size=settings.pg_pool_min_size,
+        max_size=settings.pg_pool_max_size,
+        statement_cache_size=settings.pg_statement_cache_size,
+        max_inactive_connection_lifetime=settings.pg_max_inactive_connection_lifetime_seconds,
+        command_timeout=settings.pg_command_timeout_seconds,
+        server_settings=settings.pg_server_settings or None,
+    )
+    if pool is None:
+        raise Exception("Cannot create pool")
+    pool_metrics[id(pool)] = PoolMetrics()
+    return pool
+
+
+async def close_pool(pool: asyncpg.Pool):
+    pool_metrics.pop(id(pool), None)
+    await pool.close()
+
+
+def get_pool_stats(pool: asyncpg.Pool) -> PoolStats | None:
+    metrics = pool_metrics.get(id(pool))
+    if metrics is None:
+        return None
+    return metrics.stats(pool)
+
+
+async def log_pool_stats(pool: asyncpg.Pool, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        stats = get_pool_stats(pool)
+        if stats is not None:
+            logger.info("DB pool: %s", stats.json())
+
+
+# Seconds the replica is behind, 0 when it has replayed all it received
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+class ReplicaStatus(BaseModel):
+    healthy: bool
+    lag_seconds: float | None
+    pool: PoolStats | None
+
+
+class Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool: asyncpg.Pool | None = None
+        self.healthy = False
+        self.lag_seconds: float | None = None
+
+    async def fetch_lag(self) -> float | None:
+        if self.pool is None:
+            self.pool = await create_pool(self.dsn)
+        async with acquire(self.pool) as conn:
+            return await conn.fetchval(REPLICA_LAG_QUERY)
+
+    async def check(self, max_lag_seconds: float, timeout: float):
+        """
+        Marks the replica healthy if it answers within timeout and is no
+        more than max_lag_seconds behind the primary.
+        """
+        try:
+            lag = await asyncio.wait_for(self.fetch_lag(), timeout)
+        except (
+            OSError,
+            asyncio.TimeoutError,
+            asyncpg.PostgresError,
+            asyncpg.InterfaceError,
+        ):
+            if self.healthy:
+                logger.exception("Replica check failed")
+            self.healthy = False
+            self.lag_seconds = None
+            return
+
+        self.lag_seconds = None if lag is None else float(lag)
+        healthy = self.lag_seconds is not None and self.lag_seconds <= max_lag_seconds
+        if self.healthy and not healthy:
+            logger.warning("Replica lags %s seconds behind", self.lag_seconds)
+        self.healthy = healthy
+
+    def status(self) -> ReplicaStatus:
+        return ReplicaStatus(
+            healthy=self.healthy,
+            lag_seconds=self.lag_seconds,
+            pool=None if self.pool is None else get_pool_stats(self.pool),
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            await close_pool(self.pool)
+            self.pool = None
+
 
 class Database:
     pool: asyncpg.Pool | None
 
     def __init__(self):
         self.pool = None
+        self.replicas = [Replica(dsn) for dsn in settings.pg_replica_dsns]
+        self.replicas_task: asyncio.Task | None = None
+        self.next_replica = 0
 
     async def create_pool(self):
         if self.pool is None:
-            self.pool = await asyncpg.create_pool(dsn=settings.pg_dsn)
+            self.pool = await create_pool(settings.pg_dsn)
+        if self.replicas and self.replicas_task is None:
+            await self.check_replicas()
+            self.replicas_task = asyncio.create_task(self.run_replica_checks())
+
+    async def check_replicas(self):
+        await asyncio.gather(
+            *(
+                replica.check(
+                    settings.pg_replica_max_lag_seconds,
+                    settings.pg_replica_check_seconds,
+                )
+                for replica in self.replicas
+            )
+        )
+
+    async def run_replica_checks(self):
+        while True:
+            await asyncio.sleep(settings.pg_replica_check_seconds)
+            await self.check_replicas()
+
+    def read_pool(self) -> asyncpg.Pool | None:
+        """
+        Pool for reads that may be slightly behind, a healthy replica in
+        turn or the primary if there is none.
+        """
+        pools = [r.pool for r in self.replicas if r.healthy and r.pool is not None]
+        if not pools:
+            return self.pool
+        self.next_replica = (self.next_replica + 1) % len(pools)
+        return pools[self.next_replica]
+
+    def stats(self) -> PoolStats | None:
+        if self.pool is None:
+            return None
+        return get_pool_stats(self.pool)
+
+    def replicas_status(self) -> list[ReplicaStatus]:
+        return [replica.status() for replica in self.replicas]
 
     async def close(self):
+        if self.replicas_task is not None:
+            self.replicas_task.cancel()
+            await asyncio.gather(self.replicas_task, return_exceptions=True)
+            self.replicas_task = None
+        for replica in self.replicas:
+            await replica.close()
         if self.pool is not None:
-            await self.pool.close()
+            await close_pool(self.pool)
+
+
+async def get_db_pool(request: Request) -> asyncpg.Pool:
+    return request.state.pool
+
 
+async def get_read_db_pool(request: Request) -> asyncpg.Pool:
+    """
+    For read-only endpoints, may be a replica slightly behind the primary.
+    """
+    return request.state.read_pool
 
-async def get_db_connection(request: Request):
-    pool: asyncpg.Pool = request.state.pool
-    async with pool.acquire() as connection:
+
+@asynccontextmanager
+async def acquire(
+    db: asyncpg.Pool | asyncpg.Connection,
+) -> AsyncIterator[asyncpg.Connection]:
+    """
+    Holds a connection for a single DB phase of a request only, so it is
+    back in the pool while the request waits on anything else.
+    A plain connection (e.g. a test transaction) is used as is.
+    """
+    if isinstance(db, asyncpg.Connection):
+        yield db
+        return
+
+    metrics = pool_metrics.get(id(db))
+    if metrics is None:
+        async with db.acquire() as connection:
+            yield connection
+        return
+
+    started = perf_counter()
+    metrics.waiting += 1
+    try:
+        connection = await db.acquire()
+    finally:
+        metrics.waiting -= 1
+    metrics.acquired += 1
+    metrics.wait_seconds_total += perf_counter() - started
+    try:
         yield connection
+    finally:
+        await db.release(connection)
+
+
+async def read_or_primary(
+    read_db: asyncpg.Pool | asyncpg.Connection,
+    db: asyncpg.Pool | asyncpg.Connection,
+    read: Callable[[asyncpg.Connection], Awaitable[T | None]],
+) -> T | None:
+    """
+    Runs read on read_db, and again on the primary if it found nothing
+    there, as a replica may not have caught up with a write just made.
+    """
+    async with acquire(read_db) as conn:
+        result = await read(conn)
+    if result is None and read_db is not db:
+        async with acquire(db) as conn:
+            result = await read(conn)
+    return result
+
+
+class Listener:
+    """
+    A single LISTEN connection per process, shared by every channel.
+    Notifications sent while it was not connected are lost, so each
+    channel gets a callback to resync whenever it (re)connects.
+    """
+
+    def __init__(self):
+        self.conn: asyncpg.Connection | None = None
+        self.task: asyncio.Task | None = None
+        self.channels: dict[str, Callable[[str], None]] = {}
+        self.resync_callbacks: list[Callable[[], None]] = []
+        self.reconnect_delay = LISTEN_RECONNECT_SECONDS
+
+    def add_channel(
+        self,
+        channel: str,
+        on_notify: Callable[[str], None],
+        on_resync: Callable[[], None],
+    ):
+        self.channels[channel] = on_notify
+        self.resync_callbacks.append(on_resync)
+
+    def on_notify(self, conn, pid, channel: str, payload: str):
+        self.channels[channel](payload)
+
+    def resync(self):
+        for callback in self.resync_callbacks:
+            callback()
+
+    async def listen(self):
+        closed = asyncio.Event()
+        self.conn = await asyncpg.connect(dsn=settings.pg_dsn)
+        self.conn.add_termination_listener(lambda conn: closed.set())
+        for channel in self.channels:
+            await self.conn.add_listener(channel, self.on_notify)
+        self.resync()
+        self.reconnect_delay = LISTEN_RECONNECT_SECONDS
+        await closed.wait()
+
+    async def run(self):
+        while True:
+            try:
+                await self.listen()
+            except Exception:
+                # Anything escaping here would end listening for good
+                logger.exception("LISTEN connection failed")
+            if self.conn is not None:
+                # Doesn't wait on a connection that may be half broken
+                self.conn.terminate()
+                self.conn = None
+            self.resync()
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(
+                self.reconnect_delay * 2, LISTEN_MAX_RECONNECT_SECONDS
+            )
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+listener = Listener()
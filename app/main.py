@@ -1,6 +1,9 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, status
 
-from app.db import Database
+from app.auth.hashing import password_hasher
+from app.db import Database, PoolStats, ReplicaStatus, listener
+from app.senders.email import smtp_pool
+from app.senders.telegram import telegram_sender
 from auth.api import router as auth_router
 from projects.api import router as projects_router
 from senders.api import router as senders_router
@@ -19,14 +22,34 @@ def create_app(use_db: Database | None = None):
     @app.middleware("http")
     async def db_pool_middleware(request: Request, next):
         request.state.pool = db.pool
+        request.state.read_pool = db.read_pool()
         return await next(request)
 
+    @app.get("/db/pool/", response_model=PoolStats, tags=["db"])
+    async def db_pool_stats():
+        stats = db.stats()
+        if stats is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={"reason": "no_pool", "message": "DB pool is not ready"},
+            )
+        return stats
+
+    @app.get("/db/replicas/", response_model=list[ReplicaStatus], tags=["db"])
+    async def db_replicas_status():
+        return db.replicas_status()
+
     @app.on_event("startup")
     async def startup():
         await db.create_pool()
+        listener.start()
 
     @app.on_event("shutdown")
     async def shutdown():
+        await listener.close()
         await db.close()
+        await smtp_pool.close()
+        await telegram_sender.close()
+        password_hasher.close()
 
     return app
@@ -0,0 +1,22 @@
+"""
+message lease columns
+"""
+
+from yoyo import step
+
+__depends__ = {"20220209_03_FkL4K-message-conf-table"}
+
+steps = [
+    step(
+        """
+        ALTER TABLE messages
+            ADD COLUMN locked_until INTEGER,
+            ADD COLUMN worker_id VARCHAR(128);
+        """,
+        rollback="""
+        ALTER TABLE messages
+            DROP COLUMN locked_until,
+            DROP COLUMN worker_id;
+        """,
+    )
+]
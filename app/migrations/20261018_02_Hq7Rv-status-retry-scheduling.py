@@ -0,0 +1,62 @@
+"""
+per-status retry scheduling
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_01_Ws3kL-message-lease"}
+
+steps = [
+    step(
+        """
+        ALTER TABLE email_status
+            ADD COLUMN scheduled_ts INTEGER,
+            ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN last_error TEXT,
+            ADD COLUMN locked_until INTEGER,
+            ADD COLUMN worker_id VARCHAR(128);
+        ALTER TABLE telegram_status
+            ADD COLUMN scheduled_ts INTEGER,
+            ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN last_error TEXT,
+            ADD COLUMN locked_until INTEGER,
+            ADD COLUMN worker_id VARCHAR(128);
+        """,
+        rollback="""
+        ALTER TABLE email_status
+            DROP COLUMN scheduled_ts,
+            DROP COLUMN attempts,
+            DROP COLUMN last_error,
+            DROP COLUMN locked_until,
+            DROP COLUMN worker_id;
+        ALTER TABLE telegram_status
+            DROP COLUMN scheduled_ts,
+            DROP COLUMN attempts,
+            DROP COLUMN last_error,
+            DROP COLUMN locked_until,
+            DROP COLUMN worker_id;
+        """,
+    ),
+    step(
+        """
+        UPDATE email_status SET (scheduled_ts, attempts) =
+            (messages.scheduled_ts, COALESCE(messages.attempts, 0))
+        FROM messages WHERE messages.uuid = email_status.message_uuid;
+        UPDATE telegram_status SET (scheduled_ts, attempts) =
+            (messages.scheduled_ts, COALESCE(messages.attempts, 0))
+        FROM messages WHERE messages.uuid = telegram_status.message_uuid;
+        """
+    ),
+    step(
+        """
+        ALTER TABLE messages
+            DROP COLUMN locked_until,
+            DROP COLUMN worker_id;
+        """,
+        rollback="""
+        ALTER TABLE messages
+            ADD COLUMN locked_until INTEGER,
+            ADD COLUMN worker_id VARCHAR(128);
+        """,
+    ),
+]
@@ -0,0 +1,22 @@
+"""
+message idempotency key
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_02_Hq7Rv-status-retry-scheduling"}
+
+steps = [
+    step(
+        """
+        ALTER TABLE messages ADD COLUMN idempotency_key VARCHAR(255);
+        CREATE UNIQUE INDEX messages_idempotency_key_idx
+            ON messages (project_uuid, idempotency_key)
+            WHERE idempotency_key IS NOT NULL;
+        """,
+        rollback="""
+        DROP INDEX messages_idempotency_key_idx;
+        ALTER TABLE messages DROP COLUMN idempotency_key;
+        """,
+    )
+]
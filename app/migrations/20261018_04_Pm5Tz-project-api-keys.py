@@ -0,0 +1,26 @@
+"""
+project api keys
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_03_Kd2Xa-message-idempotency-key"}
+
+steps = [
+    step(
+        """
+        CREATE TABLE api_keys (
+            uuid UUID PRIMARY KEY,
+            project_uuid UUID NOT NULL REFERENCES projects ON DELETE CASCADE,
+            name VARCHAR(64) NOT NULL,
+            key_hash BYTEA NOT NULL UNIQUE,
+            created_ts INTEGER NOT NULL,
+            revoked_ts INTEGER
+        );
+        CREATE INDEX api_keys_project_uuid_idx ON api_keys (project_uuid);
+        """,
+        rollback="""
+        DROP TABLE api_keys;
+        """,
+    )
+]
@@ -0,0 +1,27 @@
+"""
+message history indexes
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_04_Pm5Tz-project-api-keys"}
+
+steps = [
+    step(
+        """
+        CREATE INDEX messages_project_history_idx
+            ON messages (project_uuid, scheduled_ts, uuid);
+        CREATE INDEX messages_project_status_history_idx
+            ON messages (project_uuid, status, scheduled_ts, uuid);
+        CREATE INDEX email_status_message_uuid_idx ON email_status (message_uuid);
+        CREATE INDEX telegram_status_message_uuid_idx
+            ON telegram_status (message_uuid);
+        """,
+        rollback="""
+        DROP INDEX messages_project_history_idx;
+        DROP INDEX messages_project_status_history_idx;
+        DROP INDEX email_status_message_uuid_idx;
+        DROP INDEX telegram_status_message_uuid_idx;
+        """,
+    )
+]
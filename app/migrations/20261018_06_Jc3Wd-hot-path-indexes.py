@@ -0,0 +1,48 @@
+"""
+hot path indexes
+
+Built concurrently so writes keep going on large tables. A failed
+concurrent build leaves an invalid index behind, drop it before retrying.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_05_Vb8Nq-message-history-indexes"}
+
+# CREATE INDEX CONCURRENTLY can't run inside a transaction
+__transactional__ = False
+
+steps = [
+    # Due deliveries for claim_deliveries and get_next_scheduled_ts,
+    # only the few scheduled rows are indexed
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS email_status_due_idx
+            ON email_status (scheduled_ts) WHERE status = 'scheduled'
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS email_status_due_idx",
+    ),
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS telegram_status_due_idx
+            ON telegram_status (scheduled_ts) WHERE status = 'scheduled'
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS telegram_status_due_idx",
+    ),
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS email_conf_project_uuid_idx
+            ON email_conf (project_uuid)
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS email_conf_project_uuid_idx",
+    ),
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS telegram_conf_project_uuid_idx
+            ON telegram_conf (project_uuid)
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS telegram_conf_project_uuid_idx",
+    ),
+    # project_access is already covered by UNIQUE (user_uuid, project_uuid)
+    # and messages by the history indexes
+]
@@ -0,0 +1,89 @@
+"""
+unified deliveries table
+
+Replaces email_status and telegram_status with one table, the channel
+tells which conf table conf_uuid points to.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_06_Jc3Wd-hot-path-indexes"}
+
+steps = [
+    step(
+        """
+        CREATE TYPE delivery_channel AS ENUM ('email', 'telegram');
+        CREATE TABLE deliveries (
+            uuid UUID PRIMARY KEY,
+            message_uuid UUID NOT NULL REFERENCES messages ON DELETE CASCADE,
+            channel delivery_channel NOT NULL,
+            conf_uuid UUID NOT NULL,
+            status VARCHAR(64) NOT NULL,
+            scheduled_ts INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            locked_until INTEGER,
+            worker_id VARCHAR(128)
+        );
+        INSERT INTO deliveries
+            SELECT uuid, message_uuid, 'email', email_conf_uuid, status,
+                scheduled_ts, attempts, last_error, locked_until, worker_id
+            FROM email_status;
+        INSERT INTO deliveries
+            SELECT uuid, message_uuid, 'telegram', telegram_conf_uuid, status,
+                scheduled_ts, attempts, last_error, locked_until, worker_id
+            FROM telegram_status;
+        CREATE INDEX deliveries_message_uuid_idx ON deliveries (message_uuid);
+        CREATE INDEX deliveries_due_idx
+            ON deliveries (scheduled_ts) WHERE status = 'scheduled';
+        """,
+        rollback="""
+        DROP TABLE deliveries;
+        DROP TYPE delivery_channel;
+        """,
+    ),
+    step(
+        """
+        DROP TABLE email_status, telegram_status;
+        """,
+        rollback="""
+        CREATE TABLE email_status (
+            uuid UUID PRIMARY KEY,
+            message_uuid UUID REFERENCES messages ON DELETE CASCADE,
+            email_conf_uuid UUID REFERENCES email_conf ON DELETE CASCADE,
+            status VARCHAR(64),
+            scheduled_ts INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            locked_until INTEGER,
+            worker_id VARCHAR(128)
+        );
+        CREATE TABLE telegram_status (
+            uuid UUID PRIMARY KEY,
+            message_uuid UUID REFERENCES messages ON DELETE CASCADE,
+            telegram_conf_uuid UUID REFERENCES telegram_conf ON DELETE CASCADE,
+            status VARCHAR(64),
+            scheduled_ts INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            locked_until INTEGER,
+            worker_id VARCHAR(128)
+        );
+        INSERT INTO email_status
+            SELECT uuid, message_uuid, conf_uuid, status, scheduled_ts, attempts,
+                last_error, locked_until, worker_id
+            FROM deliveries WHERE channel = 'email';
+        INSERT INTO telegram_status
+            SELECT uuid, message_uuid, conf_uuid, status, scheduled_ts, attempts,
+                last_error, locked_until, worker_id
+            FROM deliveries WHERE channel = 'telegram';
+        CREATE INDEX email_status_message_uuid_idx ON email_status (message_uuid);
+        CREATE INDEX telegram_status_message_uuid_idx
+            ON telegram_status (message_uuid);
+        CREATE INDEX email_status_due_idx
+            ON email_status (scheduled_ts) WHERE status = 'scheduled';
+        CREATE INDEX telegram_status_due_idx
+            ON telegram_status (scheduled_ts) WHERE status = 'scheduled';
+        """,
+    ),
+]
@@ -0,0 +1,210 @@
+"""
+time partitioned messages and deliveries
+
+Both tables are range partitioned by an immutable created_ts, a delivery
+shares the created_ts of its message so both live in partitions of the
+same period and can be dropped together. Partitions are named
+<table>_YYYYMMDD after the UTC day they start, the maintenance job keeps
+creating future ones with create_time_partitions.
+
+Idempotency keys can't stay unique on a partitioned messages table, as
+unique indexes there must include the partition key, so they move to a
+table of their own.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_07_Rt6Yh-unified-deliveries"}
+
+# Must match the default partition_interval_days setting
+PARTITION_SECONDS = 7 * 24 * 3600
+PREMAKE_PARTITIONS = 4
+
+steps = [
+    step(
+        """
+        CREATE FUNCTION create_time_partitions(
+            parent TEXT, from_ts INTEGER, to_ts INTEGER, step INTEGER
+        ) RETURNS VOID AS $$
+        DECLARE
+            start_ts INTEGER := from_ts - from_ts % step;
+        BEGIN
+            WHILE start_ts <= to_ts LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I '
+                    'FOR VALUES FROM (%s) TO (%s)',
+                    parent || '_' || to_char(
+                        to_timestamp(start_ts) AT TIME ZONE 'UTC', 'YYYYMMDD'
+                    ),
+                    parent,
+                    start_ts,
+                    start_ts + step
+                );
+                start_ts := start_ts + step;
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        rollback="""
+        DROP FUNCTION create_time_partitions;
+        """,
+    ),
+    step(
+        f"""
+        ALTER TABLE messages RENAME TO messages_unpartitioned;
+        ALTER TABLE messages_unpartitioned
+            RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;
+        ALTER TABLE deliveries RENAME TO deliveries_unpartitioned;
+        ALTER TABLE deliveries_unpartitioned
+            RENAME CONSTRAINT deliveries_pkey TO deliveries_unpartitioned_pkey;
+
+        CREATE TABLE messages (
+            uuid UUID NOT NULL,
+            project_uuid UUID REFERENCES projects ON DELETE CASCADE,
+            title TEXT,
+            text TEXT,
+            status VARCHAR(64),
+            sync BOOLEAN,
+            scheduled_ts INTEGER,
+            attempts INTEGER,
+            idempotency_key VARCHAR(255),
+            created_ts INTEGER NOT NULL,
+            PRIMARY KEY (uuid, created_ts)
+        ) PARTITION BY RANGE (created_ts);
+        CREATE TABLE deliveries (
+            uuid UUID NOT NULL,
+            message_uuid UUID NOT NULL,
+            channel delivery_channel NOT NULL,
+            conf_uuid UUID NOT NULL,
+            status VARCHAR(64) NOT NULL,
+            scheduled_ts INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            locked_until INTEGER,
+            worker_id VARCHAR(128),
+            created_ts INTEGER NOT NULL,
+            PRIMARY KEY (uuid, created_ts),
+            FOREIGN KEY (message_uuid, created_ts)
+                REFERENCES messages (uuid, created_ts) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_ts);
+
+        -- Existing rows get their last scheduled_ts as created_ts, the
+        -- closest thing to a creation time they have
+        SELECT create_time_partitions(
+            parent,
+            COALESCE(
+                (SELECT min(scheduled_ts) FROM messages_unpartitioned),
+                extract(epoch FROM now())::INTEGER
+            ),
+            GREATEST(
+                (SELECT max(scheduled_ts) FROM messages_unpartitioned),
+                extract(epoch FROM now())::INTEGER
+            ) + {PREMAKE_PARTITIONS * PARTITION_SECONDS},
+            {PARTITION_SECONDS}
+        )
+        FROM unnest(ARRAY['messages', 'deliveries']) parent;
+
+        INSERT INTO messages
+            SELECT uuid, project_uuid, title, text, status, sync, scheduled_ts,
+                attempts, idempotency_key,
+                COALESCE(scheduled_ts, extract(epoch FROM now())::INTEGER)
+            FROM messages_unpartitioned;
+        INSERT INTO deliveries
+            SELECT d.uuid, d.message_uuid, d.channel, d.conf_uuid, d.status,
+                d.scheduled_ts, d.attempts, d.last_error, d.locked_until,
+                d.worker_id, m.created_ts
+            FROM deliveries_unpartitioned d
+                JOIN messages m ON m.uuid = d.message_uuid;
+        DROP TABLE deliveries_unpartitioned, messages_unpartitioned;
+
+        CREATE TABLE idempotency_keys (
+            project_uuid UUID NOT NULL REFERENCES projects ON DELETE CASCADE,
+            idempotency_key VARCHAR(255) NOT NULL,
+            message_uuid UUID NOT NULL,
+            created_ts INTEGER NOT NULL,
+            PRIMARY KEY (project_uuid, idempotency_key),
+            FOREIGN KEY (message_uuid, created_ts)
+                REFERENCES messages (uuid, created_ts) ON DELETE CASCADE
+        );
+        INSERT INTO idempotency_keys
+            SELECT project_uuid, idempotency_key, uuid, created_ts
+            FROM messages WHERE idempotency_key IS NOT NULL;
+
+        CREATE INDEX messages_project_history_idx
+            ON messages (project_uuid, scheduled_ts, uuid);
+        CREATE INDEX messages_project_status_history_idx
+            ON messages (project_uuid, status, scheduled_ts, uuid);
+        CREATE INDEX deliveries_message_uuid_idx ON deliveries (message_uuid);
+        CREATE INDEX deliveries_due_idx
+            ON deliveries (scheduled_ts) WHERE status = 'scheduled';
+        CREATE INDEX idempotency_keys_message_idx
+            ON idempotency_keys (message_uuid, created_ts);
+        CREATE INDEX idempotency_keys_created_ts_idx
+            ON idempotency_keys (created_ts);
+        """,
+        rollback="""
+        ALTER TABLE messages RENAME TO messages_partitioned;
+        ALTER TABLE messages_partitioned
+            RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey;
+        ALTER TABLE deliveries RENAME TO deliveries_partitioned;
+        ALTER TABLE deliveries_partitioned
+            RENAME CONSTRAINT deliveries_pkey TO deliveries_partitioned_pkey;
+        DROP INDEX messages_project_history_idx,
+            messages_project_status_history_idx,
+            deliveries_message_uuid_idx,
+            deliveries_due_idx;
+
+        CREATE TABLE messages (
+            uuid UUID PRIMARY KEY,
+            project_uuid UUID REFERENCES projects ON DELETE CASCADE,
+            title TEXT,
+            text TEXT,
+            status VARCHAR(64),
+            sync BOOLEAN,
+            scheduled_ts INTEGER,
+            attempts INTEGER,
+            idempotency_key VARCHAR(255)
+        );
+        CREATE TABLE deliveries (
+            uuid UUID PRIMARY KEY,
+            message_uuid UUID NOT NULL REFERENCES messages ON DELETE CASCADE,
+            channel delivery_channel NOT NULL,
+            conf_uuid UUID NOT NULL,
+            status VARCHAR(64) NOT NULL,
+            scheduled_ts INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            locked_until INTEGER,
+            worker_id VARCHAR(128)
+        );
+        INSERT INTO messages
+            SELECT uuid, project_uuid, title, text, status, sync, scheduled_ts,
+                attempts, idempotency_key
+            FROM messages_partitioned;
+        INSERT INTO deliveries
+            SELECT uuid, message_uuid, channel, conf_uuid, status, scheduled_ts,
+                attempts, last_error, locked_until, worker_id
+            FROM deliveries_partitioned;
+        DROP TABLE idempotency_keys, deliveries_partitioned, messages_partitioned;
+
+        CREATE UNIQUE INDEX messages_idempotency_key_idx
+            ON messages (project_uuid, idempotency_key)
+            WHERE idempotency_key IS NOT NULL;
+        CREATE INDEX messages_project_history_idx
+            ON messages (project_uuid, scheduled_ts, uuid);
+        CREATE INDEX messages_project_status_history_idx
+            ON messages (project_uuid, status, scheduled_ts, uuid);
+        CREATE INDEX deliveries_message_uuid_idx ON deliveries (message_uuid);
+        CREATE INDEX deliveries_due_idx
+            ON deliveries (scheduled_ts) WHERE status = 'scheduled';
+        """,
+    ),
+    step(
+        """
+        ALTER TABLE projects ADD COLUMN retention_days INTEGER;
+        """,
+        rollback="""
+        ALTER TABLE projects DROP COLUMN retention_days;
+        """,
+    ),
+]
@@ -0,0 +1,31 @@
+"""
+premake time partitions half a year ahead
+
+Inserts fail for periods without a partition, so keep a long runway in
+case the maintenance job is down for a while. There is no default
+partition on purpose: rows in it would block creating the partition for
+their period later on.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_08_Zp4Gm-time-partitions"}
+
+# Must match the default partition_interval_days and partition_premake
+PARTITION_SECONDS = 7 * 24 * 3600
+PREMAKE_PARTITIONS = 26
+
+steps = [
+    step(
+        f"""
+        SELECT create_time_partitions(
+            parent,
+            extract(epoch FROM now())::INTEGER,
+            extract(epoch FROM now())::INTEGER
+                + {PREMAKE_PARTITIONS * PARTITION_SECONDS},
+            {PARTITION_SECONDS}
+        )
+        FROM unnest(ARRAY['messages', 'deliveries']) parent;
+        """
+    ),
+]
@@ -0,0 +1,47 @@
+"""
+delete deliveries with their conf
+
+conf_uuid points to email_conf or telegram_conf depending on channel, so
+no foreign key can cascade conf deletes to it. Triggers do that instead,
+as the per channel status tables did.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_09_Lw6Kc-premake-partitions"}
+
+steps = [
+    step(
+        """
+        DELETE FROM deliveries
+            WHERE (channel = 'email'
+                    AND conf_uuid NOT IN (SELECT uuid FROM email_conf))
+                OR (channel = 'telegram'
+                    AND conf_uuid NOT IN (SELECT uuid FROM telegram_conf));
+
+        CREATE INDEX deliveries_conf_uuid_idx ON deliveries (conf_uuid);
+
+        CREATE FUNCTION delete_conf_deliveries() RETURNS TRIGGER AS $$
+        BEGIN
+            DELETE FROM deliveries
+                WHERE channel = TG_ARGV[0]::delivery_channel
+                    AND conf_uuid = OLD.uuid;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER email_conf_delete_deliveries
+            AFTER DELETE ON email_conf
+            FOR EACH ROW EXECUTE FUNCTION delete_conf_deliveries('email');
+        CREATE TRIGGER telegram_conf_delete_deliveries
+            AFTER DELETE ON telegram_conf
+            FOR EACH ROW EXECUTE FUNCTION delete_conf_deliveries('telegram');
+        """,
+        rollback="""
+        DROP TRIGGER telegram_conf_delete_deliveries ON telegram_conf;
+        DROP TRIGGER email_conf_delete_deliveries ON email_conf;
+        DROP FUNCTION delete_conf_deliveries;
+        DROP INDEX deliveries_conf_uuid_idx;
+        """,
+    ),
+]
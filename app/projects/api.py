@@ -1,12 +1,18 @@
-from uuid import uuid4
+from time import time
+from uuid import UUID, uuid4
 
 import asyncpg
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
 
 from app.auth.api import get_current_user
-from app.db import get_db_connection
-from app.projects.models import Project, ProjectIn
-from app.projects.queries import get_projects_for_user, insert_project
+from app.db import acquire, get_db_pool, get_read_db_pool
+from app.projects.keys import generate_api_key, hash_api_key
+from app.projects.models import (ApiKey, ApiKeyCreated, ApiKeyDB, ApiKeyIn,
+                                 Project, ProjectIn)
+from app.projects.permissions import check_project_permissions
+from app.projects.queries import (get_api_key, get_project_api_keys,
+                                  get_projects_for_user, insert_api_key,
+                                  insert_project, revoke_api_key)
 from app.users.models import User
 
 router = APIRouter(
@@ -19,19 +25,66 @@ router = APIRouter(
 async def create(
     project: ProjectIn,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    project_db = Project(
-        uuid=uuid4(), name=project.name, description=project.description
-    )
-    await insert_project(conn, project_db, current_user)
+    project_db = Project(**project.dict(), uuid=uuid4())
+    async with acquire(db) as conn:
+        await insert_project(conn, project_db, current_user)
 
     return project_db
 
 
 @router.get("/", response_model=list[Project])
-async def list(
+async def list_projects(
+    current_user: User = Depends(get_current_user),
+    read_db: asyncpg.Pool = Depends(get_read_db_pool),
+):
+    async with acquire(read_db) as conn:
+        return await get_projects_for_user(conn, current_user)
+
+
+@router.post("/keys/", response_model=ApiKeyCreated)
+async def create_api_key(
+    api_key: ApiKeyIn,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    return await get_projects_for_user(conn, current_user)
+    key = generate_api_key(api_key.project_uuid)
+    api_key_db = ApiKeyDB(
+        **api_key.dict(),
+        uuid=uuid4(),
+        created_ts=int(time()),
+        key_hash=hash_api_key(key),
+    )
+    async with acquire(db) as conn:
+        await check_project_permissions(conn, current_user, api_key.project_uuid)
+        await insert_api_key(conn, api_key_db)
+
+    return ApiKeyCreated(**api_key_db.dict(), key=key)
+
+
+@router.get("/keys/", response_model=list[ApiKey])
+async def list_api_keys(
+    project_uuid: UUID,
+    current_user: User = Depends(get_current_user),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    async with acquire(db) as conn:
+        await check_project_permissions(conn, current_user, project_uuid)
+        return await get_project_api_keys(conn, project_uuid)
+
+
+@router.post("/keys/revoke/", response_model=ApiKey)
+async def revoke(
+    key_uuid: UUID,
+    current_user: User = Depends(get_current_user),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    async with acquire(db) as conn:
+        api_key = await get_api_key(conn, key_uuid)
+        if api_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        await check_project_permissions(conn, current_user, api_key.project_uuid)
+
+        return await revoke_api_key(conn, api_key, int(time()))
@@ -0,0 +1,79 @@
+from typing import Callable, Hashable, TypeVar
+from uuid import UUID
+
+import asyncpg
+
+from app.cache import LRUCache
+from app.db import listener
+
+PROJECTS_CHANNEL = "herodotus_projects"
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+project_caches: list["ProjectCache"] = []
+
+
+class ProjectCache(LRUCache[K, V]):
+    """
+    LRUCache of per-project data. All entries of a project are dropped
+    when it changes, in this process right away and in the others once
+    the change is committed and its NOTIFY arrives.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float | None, project_uuid: Callable[[K], UUID]
+    ):
+        super().__init__(maxsize, ttl)
+        self.project_uuid = project_uuid
+        # Bumped on every invalidation, see set_loaded
+        self.epoch = 0
+        project_caches.append(self)
+
+    def set_loaded(self, key: K, value: V, epoch: int):
+        """
+        Caches a value loaded from the DB unless anything was invalidated
+        since epoch, as the value may have been read before that change.
+        """
+        if epoch == self.epoch:
+            self.set(key, value)
+
+    def invalidate(self, project_uuid: UUID):
+        self.epoch += 1
+        for key in [k for k in self.data if self.project_uuid(k) == project_uuid]:
+            del self.data[key]
+
+    def clear(self):
+        self.epoch += 1
+        super().clear()
+
+
+def invalidate_project(project_uuid: UUID):
+    for cache in project_caches:
+        cache.invalidate(project_uuid)
+
+
+def invalidate_all_projects():
+    for cache in project_caches:
+        cache.clear()
+
+
+async def notify_project_changed(conn: asyncpg.Connection, project_uuid: UUID):
+    """
+    Invalidates cached project data here and, on commit of the current
+    transaction, in every listening process.
+    """
+    invalidate_project(project_uuid)
+    await conn.execute("SELECT pg_notify($1, $2)", PROJECTS_CHANNEL, str(project_uuid))
+
+
+def on_project_changed(payload: str):
+    try:
+        invalidate_project(UUID(payload))
+    except ValueError:
+        invalidate_all_projects()
+
+
+# Anything may have changed while the listener was not connected,
+# the caches ttl bounds staleness meanwhile
+listener.add_channel(PROJECTS_CHANNEL, on_project_changed, invalidate_all_projects)
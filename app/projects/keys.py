@@ -0,0 +1,66 @@
+import hashlib
+import hmac
+import secrets
+from uuid import UUID
+
+import asyncpg
+
+from app.db import acquire
+from app.projects.cache import ProjectCache
+from app.projects.models import ApiKeyDB
+from app.projects.queries import get_active_api_key_by_hash
+from app.settings import settings
+
+API_KEY_PREFIX = "hd"
+
+# (project_uuid, key_hash) -> active key, unknown keys are never cached
+api_key_cache: ProjectCache[tuple[UUID, bytes], ApiKeyDB] = ProjectCache(
+    settings.project_cache_size,
+    settings.project_cache_ttl_seconds,
+    lambda key: key[0],
+)
+
+
+def hash_api_key(key: str) -> bytes:
+    secret = settings.api_key_secret or settings.auth_key
+    return hmac.new(secret.encode(), key.encode(), hashlib.sha256).digest()
+
+
+def generate_api_key(project_uuid: UUID) -> str:
+    """
+    Keys carry their project, so a key is cached and invalidated together
+    with the rest of the project data.
+    """
+    return f"{API_KEY_PREFIX}_{project_uuid.hex}_{secrets.token_urlsafe(32)}"
+
+
+def parse_api_key_project(key: str) -> UUID | None:
+    prefix, _, rest = key.partition("_")
+    project_hex, _, secret = rest.partition("_")
+    if prefix != API_KEY_PREFIX or not secret:
+        return None
+    try:
+        return UUID(hex=project_hex)
+    except ValueError:
+        return None
+
+
+async def verify_api_key(
+    db: asyncpg.Pool | asyncpg.Connection, key: str
+) -> ApiKeyDB | None:
+    project_uuid = parse_api_key_project(key)
+    if project_uuid is None:
+        return None
+
+    key_hash = hash_api_key(key)
+    api_key = api_key_cache.get((project_uuid, key_hash))
+    if api_key is not None:
+        return api_key
+
+    epoch = api_key_cache.epoch
+    async with acquire(db) as conn:
+        api_key = await get_active_api_key_by_hash(conn, key_hash)
+    if api_key is None or api_key.project_uuid != project_uuid:
+        return None
+    api_key_cache.set_loaded((project_uuid, key_hash), api_key, epoch)
+    return api_key
@@ -9,6 +9,8 @@ from app.users.models import User
 class ProjectBase(BaseModel):
     name: str = Field(max_length=64)
     description: str
+    # Days messages are kept for, settings.retention_days if not set
+    retention_days: int | None = Field(None, gt=0)
 
 
 class ProjectIn(ProjectBase):
@@ -42,3 +44,23 @@ class ProjectAccessDB(ProjectAccessIn):
     uuid: UUID
     user_uuid: UUID
     project_uuid: UUID
+
+
+class ApiKeyIn(BaseModel):
+    project_uuid: UUID
+    name: str = Field(max_length=64)
+
+
+class ApiKey(ApiKeyIn):
+    uuid: UUID
+    created_ts: int
+    revoked_ts: int | None = None
+
+
+class ApiKeyCreated(ApiKey):
+    # Only ever shown once, the DB keeps its hash
+    key: str
+
+
+class ApiKeyDB(ApiKey):
+    key_hash: bytes
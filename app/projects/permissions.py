@@ -0,0 +1,48 @@
+from uuid import UUID
+
+import asyncpg
+from fastapi import HTTPException, status
+
+from app.projects.cache import ProjectCache
+from app.projects.models import AccessType, ProjectAccessDB
+from app.projects.queries import get_project_access
+from app.settings import settings
+from app.users.models import User
+
+# (project_uuid, user_uuid) -> access, a missing access is never cached
+project_access_cache: ProjectCache[tuple[UUID, UUID], ProjectAccessDB] = ProjectCache(
+    settings.project_cache_size,
+    settings.project_cache_ttl_seconds,
+    lambda key: key[0],
+)
+
+
+def not_enough_permissions() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail={
+            "reason": "not_enough_project_permissions",
+            "message": "Project doesn't exist or you don't have enough permissions",
+        },
+    )
+
+
+async def get_owner_access(
+    conn: asyncpg.Connection, user: User, project_uuid: UUID
+) -> ProjectAccessDB | None:
+    access = project_access_cache.get((project_uuid, user.uuid))
+    if access is None:
+        epoch = project_access_cache.epoch
+        access = await get_project_access(conn, project_uuid, user)
+        if access is not None:
+            project_access_cache.set_loaded((project_uuid, user.uuid), access, epoch)
+    if access is None or access.type != AccessType.owner:
+        return None
+    return access
+
+
+async def check_project_permissions(
+    conn: asyncpg.Connection, user: User, project_uuid: UUID
+):
+    if await get_owner_access(conn, user, project_uuid) is None:
+        raise not_enough_permissions()
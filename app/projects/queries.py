@@ -2,7 +2,8 @@ from uuid import UUID, uuid4
 
 import asyncpg
 
-from app.projects.models import AccessType, Project, ProjectAccessDB
+from app.projects.cache import notify_project_changed
+from app.projects.models import AccessType, ApiKeyDB, Project, ProjectAccessDB
 from app.users.models import User
 
 
@@ -11,10 +12,11 @@ async def insert_project(
 ) -> None:
     async with conn.transaction():
         await conn.execute(
-            "INSERT INTO projects(uuid, name, description) VALUES ($1, $2, $3)",
+            "INSERT INTO projects(uuid, name, description, retention_days) VALUES ($1, $2, $3, $4)",
             project.uuid,
             project.name,
             project.description,
+            project.retention_days,
         )
 
         await conn.execute(
@@ -24,6 +26,7 @@ async def insert_project(
             project.uuid,
             AccessType.owner.value,
         )
+        await notify_project_changed(conn, project.uuid)
 
 
 async def get_project_by_uuid(conn: asyncpg.Connection, uuid: UUID) -> Project | None:
@@ -62,3 +65,94 @@ async def get_projects_for_user(conn: asyncpg.Connection, user: User) -> list[Pr
         user.uuid,
     )
     return [Project(**p_raw) for p_raw in raw]
+
+
+async def get_max_retention_days(conn: asyncpg.Connection) -> int | None:
+    return await conn.fetchval("SELECT max(retention_days) FROM projects")
+
+
+async def get_retentions_below(
+    conn: asyncpg.Connection, default_days: int, max_days: int
+) -> dict[UUID, int]:
+    """
+    Projects keeping messages for less than max_days, with the days they
+    keep them for. Projects without a retention of their own keep them
+    for default_days.
+    """
+    raw: list[asyncpg.Record] = await conn.fetch(
+        """
+        SELECT uuid, COALESCE(retention_days, $1) AS retention_days
+        FROM projects
+        WHERE COALESCE(retention_days, $1) < $2
+        """,
+        default_days,
+        max_days,
+    )
+    return {p["uuid"]: p["retention_days"] for p in raw}
+
+
+async def insert_api_key(conn: asyncpg.Connection, api_key: ApiKeyDB) -> None:
+    async with conn.transaction():
+        await conn.execute(
+            """
+            INSERT INTO api_keys(uuid, project_uuid, name, key_hash, created_ts)
+                VALUES ($1, $2, $3, $4, $5)
+            """,
+            api_key.uuid,
+            api_key.project_uuid,
+            api_key.name,
+            api_key.key_hash,
+            api_key.created_ts,
+        )
+        await notify_project_changed(conn, api_key.project_uuid)
+
+
+async def get_api_key(conn: asyncpg.Connection, uuid: UUID) -> ApiKeyDB | None:
+    raw: asyncpg.Record = await conn.fetchrow(
+        "SELECT * FROM api_keys WHERE uuid = $1", uuid
+    )
+    if raw is None:
+        return None
+
+    return ApiKeyDB(**raw)
+
+
+async def get_active_api_key_by_hash(
+    conn: asyncpg.Connection, key_hash: bytes
+) -> ApiKeyDB | None:
+    raw: asyncpg.Record = await conn.fetchrow(
+        "SELECT * FROM api_keys WHERE key_hash = $1 AND revoked_ts IS NULL",
+        key_hash,
+    )
+    if raw is None:
+        return None
+
+    return ApiKeyDB(**raw)
+
+
+async def get_project_api_keys(
+    conn: asyncpg.Connection, project_uuid: UUID
+) -> list[ApiKeyDB]:
+    raw: list[asyncpg.Record] = await conn.fetch(
+        "SELECT * FROM api_keys WHERE project_uuid = $1 ORDER BY created_ts",
+        project_uuid,
+    )
+    return [ApiKeyDB(**k) for k in raw]
+
+
+async def revoke_api_key(
+    conn: asyncpg.Connection, api_key: ApiKeyDB, revoked_ts: int
+) -> ApiKeyDB:
+    async with conn.transaction():
+        raw: asyncpg.Record = await conn.fetchrow(
+            """
+            UPDATE api_keys SET revoked_ts = COALESCE(revoked_ts, $2)
+            WHERE uuid = $1
+            RETURNING *
+            """,
+            api_key.uuid,
+            revoked_ts,
+        )
+        await notify_project_changed(conn, api_key.project_uuid)
+
+    return ApiKeyDB(**raw)
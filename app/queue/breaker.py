@@ -0,0 +1,68 @@
+from enum import Enum
+from time import monotonic, time
+
+
+class BreakerState(str, Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops sending through a channel after failure_threshold consecutive
+    failures. After reset_timeout a single probe send is let through:
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BreakerState.closed
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == BreakerState.closed:
+            return True
+        if self.state == BreakerState.open:
+            if monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = BreakerState.half_open
+                return True
+        return False
+
+    def ready(self) -> bool:
+        """
+        Whether allow() would let a send through, without starting a probe.
+        """
+        if self.state == BreakerState.closed:
+            return True
+        if self.state == BreakerState.open:
+            return monotonic() - self.opened_at >= self.reset_timeout
+        # The probe is still out
+        return False
+
+    def record_success(self):
+        self.state = BreakerState.closed
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if (
+            self.state == BreakerState.half_open
+            or self.failures >= self.failure_threshold
+        ):
+            self.state = BreakerState.open
+            self.opened_at = monotonic()
+
+    def retry_ts(self) -> int:
+        """
+        Unix time at which the channel is worth trying again.
+        """
+        if self.state == BreakerState.closed:
+            return int(time())
+        if self.state == BreakerState.half_open:
+            # Depends on the probe, a failure opens for reset_timeout again
+            return int(time() + self.reset_timeout) + 1
+        remaining = self.opened_at + self.reset_timeout - monotonic()
+        return int(time() + max(0, remaining)) + 1
@@ -0,0 +1,201 @@
+"""
+Partition maintenance of messages and deliveries: creates partitions for
+the coming periods, deletes messages of projects keeping them for less
+than the longest retention, and drops partitions past that retention,
+exporting them first if settings.archive_dir is set.
+
+Any number of these may run, an advisory lock lets one of them at a time
+do the work.
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import re
+from time import time
+from typing import NamedTuple
+
+import asyncpg
+
+from app.projects.queries import get_max_retention_days, get_retentions_below
+from app.senders.queries import delete_expired_messages
+from app.settings import settings
+
+DAY_SECONDS = 24 * 3600
+# Any number, as long as nothing else takes the same advisory lock
+MAINTENANCE_LOCK_ID = 0x6865726F
+# Referencing tables first, their partitions have to go first
+PARTITIONED_TABLES = ["deliveries", "messages"]
+
+PARTITION_BOUND_RE = re.compile(r"FROM \((\d+)\) TO \((\d+)\)")
+
+logger = logging.getLogger(__name__)
+
+
+class Partition(NamedTuple):
+    name: str
+    from_ts: int
+    to_ts: int
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+async def create_partitions(conn: asyncpg.Connection, from_ts: int, to_ts: int):
+    """
+    Makes sure every period between from_ts and to_ts has its partitions.
+    """
+    step = settings.partition_interval_days * DAY_SECONDS
+    for table in PARTITIONED_TABLES:
+        await conn.execute(
+            "SELECT create_time_partitions($1, $2, $3, $4)",
+            table,
+            from_ts,
+            to_ts,
+            step,
+        )
+
+
+async def get_partitions(conn: asyncpg.Connection, table: str) -> list[Partition]:
+    raw = await conn.fetch(
+        """
+        SELECT child.relname AS name,
+            pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = $1
+        """,
+        table,
+    )
+    partitions = []
+    for p in raw:
+        match = PARTITION_BOUND_RE.search(p["bound"])
+        if match is None:
+            continue
+        partitions.append(
+            Partition(p["name"], int(match.group(1)), int(match.group(2)))
+        )
+    return sorted(partitions, key=lambda p: p.from_ts)
+
+
+async def archive_partition(conn: asyncpg.Connection, partition: Partition) -> str:
+    """
+    Exports a partition to <archive_dir>/<partition>.csv.gz. The file only
+    shows up under its name once complete.
+    """
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    path = os.path.join(settings.archive_dir, f"{partition.name}.csv.gz")
+    with gzip.open(f"{path}.tmp", "wb") as archive:
+
+        async def write(chunk: bytes):
+            archive.write(chunk)
+
+        await conn.copy_from_table(
+            partition.name, output=write, format="csv", header=True
+        )
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+async def drop_partition(conn: asyncpg.Connection, table: str, partition: Partition):
+    async with conn.transaction():
+        if table == "messages":
+            # Keys are not partitioned, and would block the detach
+            await conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_ts >= $1 AND created_ts < $2",
+                partition.from_ts,
+                partition.to_ts,
+            )
+        await conn.execute(
+            f"ALTER TABLE {quote_ident(table)} "
+            f"DETACH PARTITION {quote_ident(partition.name)}"
+        )
+        await conn.execute(f"DROP TABLE {quote_ident(partition.name)}")
+
+
+async def drop_expired_partitions(conn: asyncpg.Connection, before_ts: int) -> int:
+    """
+    Drops partitions holding nothing newer than before_ts.
+    """
+    dropped = 0
+    for table in PARTITIONED_TABLES:
+        for partition in await get_partitions(conn, table):
+            if partition.to_ts > before_ts:
+                break
+            if settings.archive_dir:
+                path = await archive_partition(conn, partition)
+                logger.info("Archived %s to %s", partition.name, path)
+            await drop_partition(conn, table, partition)
+            logger.info("Dropped partition %s", partition.name)
+            dropped += 1
+    return dropped
+
+
+async def delete_expired(conn: asyncpg.Connection, now: int, max_days: int) -> int:
+    """
+    Deletes the messages of projects with a retention shorter than
+    max_days row by row, in batches so locks are held only briefly.
+    """
+    deleted = 0
+    retentions = await get_retentions_below(conn, settings.retention_days, max_days)
+    for project_uuid, days in retentions.items():
+        while True:
+            count = await delete_expired_messages(
+                conn,
+                project_uuid,
+                now - days * DAY_SECONDS,
+                settings.retention_delete_batch_size,
+            )
+            deleted += count
+            if count < settings.retention_delete_batch_size:
+                break
+    return deleted
+
+
+async def run_maintenance(conn: asyncpg.Connection, now: int | None = None) -> bool:
+    """
+    Runs one maintenance pass, returns False without doing anything if
+    another runner holds the lock.
+    """
+    locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", MAINTENANCE_LOCK_ID)
+    if not locked:
+        return False
+
+    try:
+        if now is None:
+            now = int(time())
+        step = settings.partition_interval_days * DAY_SECONDS
+        await create_partitions(conn, now, now + settings.partition_premake * step)
+
+        # Whole partitions can only go once no project needs them anymore
+        max_days = max(settings.retention_days, await get_max_retention_days(conn) or 0)
+        deleted = await delete_expired(conn, now, max_days)
+        dropped = await drop_expired_partitions(conn, now - max_days * DAY_SECONDS)
+        logger.info(
+            "Maintenance done, %d messages deleted, %d partitions dropped",
+            deleted,
+            dropped,
+        )
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_ID)
+    return True
+
+
+async def main():
+    while True:
+        try:
+            conn = await asyncpg.connect(dsn=settings.pg_dsn)
+            try:
+                await run_maintenance(conn)
+            finally:
+                await conn.close()
+        except Exception:
+            logger.exception("Maintenance failed")
+        await asyncio.sleep(settings.maintenance_interval_seconds)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
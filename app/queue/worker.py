@@ -1,98 +1,343 @@
 import asyncio
+import logging
+import os
+import random
+import socket
+from enum import Enum
 from time import time
+from typing import Callable
+from uuid import uuid4
 
 import asyncpg
 
-from app.senders.email import send_emails
-from app.senders.models import EmailStatus, Message, MessageStatus, TelegramStatus
+from app.db import acquire, close_pool, create_pool, log_pool_stats
+from app.queue import maintenance
+from app.queue.breaker import CircuitBreaker
+from app.senders.dispatch import send_to_conf
+from app.senders.email import smtp_pool
+from app.senders.models import Channel, Message, MessageStatus, Status
 from app.senders.queries import (
-    get_email_conf,
-    get_statuses_for_message,
-    get_telegram_conf,
-    get_unprocessed_messages,
-    update_email_status,
-    update_message,
-    update_telegram_status,
+    MESSAGES_CHANNEL,
+    Delivery,
+    claim_deliveries,
+    finalize_messages,
+    get_messages,
+    get_next_scheduled_ts,
+    lock_messages,
+    notify_statuses_changed,
+    release_statuses,
 )
-from app.senders.telegram import send_telegram
+from app.senders.telegram import telegram_sender
 from app.settings import settings
 
-ITERATION_TIME_SECONDS = 10
+POLL_INTERVAL_SECONDS = 60
 INITIAL_TIMEOUT_SECONDS = 5
+MAX_ERROR_LENGTH = 1000
 
+logger = logging.getLogger(__name__)
 
-class Worker:
-    def __init__(self, pool: asyncpg.Pool):
+
+def backoff_seconds(attempts: int) -> int:
+    """
+    Exponential backoff capped at worker_max_backoff_seconds, with jitter
+    so deliveries that failed together don't retry together.
+    """
+    backoff = min(
+        settings.worker_max_backoff_seconds,
+        INITIAL_TIMEOUT_SECONDS * 2 ** min(attempts, 32),
+    )
+    return int(random.uniform(backoff / 2, backoff))
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+class DeliveryResult(str, Enum):
+    sent = "sent"
+    failed = "failed"
+    # Channel breaker is open, nothing was attempted
+    skipped = "skipped"
+
+
+class ResultAccumulator:
+    """
+    Collects delivery results and writes them in bulk, in one transaction,
+    once max_size results are pending or flush_interval has passed.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        worker_id: str,
+        max_size: int,
+        flush_interval: float,
+        on_rescheduled: Callable[[int], None] | None = None,
+    ):
         self.pool = pool
+        self.worker_id = worker_id
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        # Called with the scheduled_ts of each retry once its lease is gone
+        self.on_rescheduled = on_rescheduled
+        self.statuses: list[Status] = []
+        self.lock = asyncio.Lock()
 
-    async def process_status(
-        self, status: EmailStatus | TelegramStatus, message: Message
-    ) -> bool:
-        if status.status == MessageStatus.sent:
-            return True
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+    async def add_status(self, status: Status):
+        self.statuses.append(status)
+        if len(self) < self.max_size:
+            return
         try:
-            async with self.pool.acquire() as conn:
-                if isinstance(status, EmailStatus):
-                    email_conf = await get_email_conf(conn, status.email_conf_uuid)
-                    if email_conf is None:
-                        return True
-                    await send_emails([email_conf.email], message)
-                    status.status = MessageStatus.sent
-                    await update_email_status(conn, status)
-                elif isinstance(status, TelegramStatus):
-                    telegram_conf = await get_telegram_conf(
-                        conn, status.telegram_conf_uuid
-                    )
-                    if telegram_conf is None:
-                        return True
-                    await send_telegram([telegram_conf.chat_id], message)
-                    status.status = MessageStatus.sent
-                    await update_telegram_status(conn, status)
-            return True
+            await self.flush()
         except Exception:
-            return False
+            logger.exception("Failed to flush delivery results")
+
+    async def flush(self):
+        async with self.lock:
+            statuses, self.statuses = self.statuses, []
+            if not statuses:
+                return
+
+            message_keys = list({(s.message_uuid, s.created_ts) for s in statuses})
+            try:
+                async with acquire(self.pool) as conn:
+                    async with conn.transaction():
+                        await lock_messages(conn, message_keys)
+                        await release_statuses(conn, statuses, self.worker_id)
+                        await finalize_messages(conn, message_keys)
+                        await notify_statuses_changed(
+                            conn, [uuid for uuid, _ in message_keys]
+                        )
+            except Exception:
+                # Keep results for the next flush
+                self.statuses[:0] = statuses
+                raise
 
-    async def process_message(self, message: Message):
-        async with self.pool.acquire() as conn:
-            statuses = await get_statuses_for_message(conn, message.uuid)
-            res = await asyncio.gather(
-                *[self.process_status(status, message) for status in statuses]
+        if self.on_rescheduled is not None:
+            for status in statuses:
+                if status.status == MessageStatus.scheduled and status.scheduled_ts:
+                    self.on_rescheduled(status.scheduled_ts)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush delivery results")
+
+
+class Worker:
+    def __init__(self, pool: asyncpg.Pool, worker_id: str | None = None):
+        self.pool = pool
+        self.worker_id = worker_id or make_worker_id()
+        self.listen_conn: asyncpg.Connection | None = None
+        # Set when work is due now
+        self.wakeup = asyncio.Event()
+        # Set when the producer should recompute how long to sleep
+        self.rescheduled = asyncio.Event()
+        self.next_wakeup_ts: int | None = None
+        self.results = ResultAccumulator(
+            pool,
+            self.worker_id,
+            settings.worker_flush_size,
+            settings.worker_flush_interval_seconds,
+            self.schedule_wakeup,
+        )
+        self.breakers = {
+            channel: CircuitBreaker(
+                settings.worker_breaker_failure_threshold,
+                settings.worker_breaker_reset_seconds,
             )
-            if all(res):
-                message.status = MessageStatus.sent
-            else:
-                message.scheduled_ts = int(time()) + INITIAL_TIMEOUT_SECONDS * (
-                    2**message.attempts
-                )
-            message.attempts += 1
+            for channel in Channel
+        }
+        self.queue: asyncio.Queue[tuple[Delivery, Message]] = asyncio.Queue(
+            maxsize=settings.worker_batch_size
+        )
 
-            await update_message(conn, message)
+    def schedule_wakeup(self, scheduled_ts: int):
+        if scheduled_ts <= time():
+            self.wakeup.set()
+        elif self.next_wakeup_ts is None or scheduled_ts < self.next_wakeup_ts:
+            self.next_wakeup_ts = scheduled_ts
+        else:
+            return
+        self.rescheduled.set()
 
-    async def process_messages(self, messages: list[Message]):
-        await asyncio.gather(*[self.process_message(message) for message in messages])
+    def on_notify(self, conn, pid, channel, payload: str):
+        try:
+            scheduled_ts = int(payload)
+        except ValueError:
+            scheduled_ts = 0
+        self.schedule_wakeup(scheduled_ts)
 
-    async def run_iteration(self):
-        async with self.pool.acquire() as conn:
-            messages = await get_unprocessed_messages(conn)
+    async def listen(self):
+        if self.listen_conn is not None and not self.listen_conn.is_closed():
+            return
+        self.listen_conn = await asyncpg.connect(dsn=settings.pg_dsn)
+        await self.listen_conn.add_listener(MESSAGES_CHANNEL, self.on_notify)
+        # Anything sent while we were not listening is picked up right away
+        self.wakeup.set()
 
-        await self.process_messages(messages)
+    async def wait_for_work(self):
+        """
+        Sleeps until a notification arrives, the earliest known future
+        message becomes due, or the safety poll interval runs out. Wakeups
+        scheduled meanwhile shorten the sleep.
+        """
+        deadline = time() + POLL_INTERVAL_SECONDS
+        while not self.wakeup.is_set():
+            wakeup_ts = deadline
+            if self.next_wakeup_ts is not None:
+                wakeup_ts = min(wakeup_ts, self.next_wakeup_ts)
+            timeout = wakeup_ts - time()
+            if timeout <= 0:
+                break
+            self.rescheduled.clear()
+            try:
+                await asyncio.wait_for(self.rescheduled.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.wakeup.clear()
+        if self.next_wakeup_ts is not None and self.next_wakeup_ts <= time():
+            self.next_wakeup_ts = None
 
-    async def run(self):
+    def schedule_breakers_wakeup(self):
+        """
+        Wakes up when open breakers let their channel through again.
+        """
+        for breaker in self.breakers.values():
+            if not breaker.ready():
+                self.schedule_wakeup(breaker.retry_ts())
+
+    def get_breaker(self, status: Status) -> CircuitBreaker:
+        return self.breakers[status.channel]
+
+    async def process_status(
+        self, delivery: Delivery, message: Message
+    ) -> DeliveryResult:
+        status, conf = delivery
+        breaker = self.get_breaker(status)
+        if not breaker.allow():
+            # Nothing is wrong with the delivery itself, retry it as soon as
+            # the channel is let through again without spending an attempt
+            status.scheduled_ts = breaker.retry_ts()
+            result = DeliveryResult.skipped
+        else:
+            try:
+                # Only the request itself is timed, waiting on the channel's
+                # rate limits is not a failure of the channel
+                await send_to_conf(conf, message, settings.worker_send_timeout_seconds)
+            except Exception as e:
+                breaker.record_failure()
+                status.last_error = (repr(e) or type(e).__name__)[:MAX_ERROR_LENGTH]
+                status.scheduled_ts = int(time()) + backoff_seconds(status.attempts)
+                status.attempts += 1
+                if status.attempts >= settings.worker_max_attempts:
+                    status.status = MessageStatus.dead
+                result = DeliveryResult.failed
+            else:
+                breaker.record_success()
+                status.status = MessageStatus.sent
+                status.last_error = None
+                status.attempts += 1
+                result = DeliveryResult.sent
+
+        # The wakeup for a retry comes once the flush released its lease
+        await self.results.add_status(status)
+        return result
+
+    async def consume(self):
         while True:
-            await self.run_iteration()
-            await asyncio.sleep(ITERATION_TIME_SECONDS)
+            delivery, message = await self.queue.get()
+            try:
+                await self.process_status(delivery, message)
+            finally:
+                self.queue.task_done()
 
+    async def fill_queue(self) -> int:
+        """
+        Claims the next batch of due deliveries and hands it to consumers.
+        Blocks while the queue is full, so at most one batch is prefetched
+        ahead of sending. Channels whose breaker is open are left in the
+        table, so they don't fill batches the other channels wait behind.
+        """
+        channels = [c for c, breaker in self.breakers.items() if breaker.ready()]
+        if not channels:
+            self.schedule_breakers_wakeup()
+            return 0
 
-async def create_pool() -> asyncpg.Pool:
-    pool = await asyncpg.create_pool(dsn=settings.pg_dsn)
-    if pool is None:
-        raise Exception("Cannot create pool")
-    return pool
+        async with acquire(self.pool) as conn:
+            deliveries = await claim_deliveries(
+                conn,
+                self.worker_id,
+                settings.worker_lease_seconds,
+                settings.worker_batch_size,
+                channels,
+            )
+            messages = await get_messages(
+                conn,
+                list(
+                    {
+                        (status.message_uuid, status.created_ts)
+                        for status, _ in deliveries
+                    }
+                ),
+            )
+            next_ts = await get_next_scheduled_ts(conn)
+        if next_ts is not None:
+            self.schedule_wakeup(next_ts)
+        self.schedule_breakers_wakeup()
+
+        for delivery in deliveries:
+            status, _ = delivery
+            await self.queue.put((delivery, messages[status.message_uuid]))
+
+        return len(deliveries)
+
+    async def produce(self):
+        while True:
+            await self.listen()
+            claimed = await self.fill_queue()
+            if claimed < settings.worker_batch_size:
+                await self.wait_for_work()
+
+    async def run(self):
+        consumers = [
+            asyncio.create_task(self.consume())
+            for _ in range(settings.worker_concurrency)
+        ]
+        flusher = asyncio.create_task(self.results.run())
+        try:
+            await self.produce()
+        finally:
+            for task in [*consumers, flusher]:
+                task.cancel()
+            await asyncio.gather(*consumers, flusher, return_exceptions=True)
+            await self.results.flush()
+            if self.listen_conn is not None:
+                await self.listen_conn.close()
 
 
 async def main():
-    pool = await create_pool()
-    await Worker(pool).run()
+    pool = await create_pool(settings.pg_dsn)
+    background = [
+        asyncio.create_task(log_pool_stats(pool, settings.pg_pool_stats_log_seconds))
+    ]
+    if settings.worker_run_maintenance:
+        # The advisory lock keeps it to one worker at a time
+        background.append(asyncio.create_task(maintenance.main()))
+    try:
+        await Worker(pool).run()
+    finally:
+        for task in background:
+            task.cancel()
+        await smtp_pool.close()
+        await telegram_sender.close()
+        await close_pool(pool)
 
 
 if __name__ == "__main__":
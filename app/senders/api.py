@@ -1,68 +1,156 @@
+import asyncio
 from time import time
+from typing import AsyncIterator
 from uuid import UUID, uuid4
 
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.auth.api import get_current_user
-from app.db import get_db_connection
-from app.projects.models import AccessType
-from app.projects.queries import get_project_access
-from app.senders.email import send_emails
-from app.senders.models import (EmailConfIn, EmailConfInDb, EmailStatus,
-                                Message, MessageIn, MessageStatus,
-                                TelegramConfIn, TelegramConfInDb,
+from app.auth.api import get_current_user, optional_oauth2_scheme
+from app.cache import LRUCache
+from app.db import acquire, get_db_pool, get_read_db_pool, read_or_primary
+from app.projects.cache import ProjectCache
+from app.projects.keys import verify_api_key
+from app.projects.models import ApiKeyDB
+from app.projects.permissions import (check_project_permissions,
+                                      get_owner_access, not_enough_permissions)
+from app.queue.worker import backoff_seconds
+from app.senders.dispatch import send_to_conf
+from app.senders.models import (Channel, EmailConfIn, EmailConfInDb,
+                                EmailStatus, Message, MessageIn, MessageStatus,
+                                Status, TelegramConfIn, TelegramConfInDb,
                                 TelegramStatus)
-from app.senders.queries import (get_message, get_project_confs,
-                                 get_statuses_for_message, insert_email_conf,
-                                 insert_email_statuses, insert_message,
-                                 insert_telegram_conf,
-                                 insert_telegram_statuses)
-from app.senders.telegram import send_telegram
+from app.senders.queries import (copy_messages, copy_statuses,
+                                 finalize_messages, get_dead_messages,
+                                 get_message, get_messages_by_idempotency_keys,
+                                 get_messages_page, get_project_confs,
+                                 get_statuses_for_message,
+                                 get_statuses_for_messages, insert_email_conf,
+                                 insert_message, insert_statuses,
+                                 insert_telegram_conf, lock_messages,
+                                 notify_messages_scheduled,
+                                 notify_statuses_changed, release_statuses,
+                                 requeue_message)
+from app.senders.stream import sse_event, status_hub
+from app.settings import settings
 from app.users.models import User
 
+STREAM_KEEPALIVE_SECONDS = 15
+
 router = APIRouter(
     prefix="/senders",
     tags=["senders"],
 )
 
 
-async def check_project_permissions(
-    conn: asyncpg.Connection, user: User, project_uuid: UUID
-):
-    access = await get_project_access(conn, project_uuid, user)
-    if access is None or access.type != AccessType.owner:
+class Sender(BaseModel):
+    """
+    Who is sending: a user with a bearer token or a project API key.
+    """
+
+    user: User | None = None
+    api_key: ApiKeyDB | None = None
+
+
+async def get_sender(
+    token: str | None = Depends(optional_oauth2_scheme),
+    x_api_key: str | None = Header(None),
+    db: asyncpg.Pool = Depends(get_db_pool),
+    read_db: asyncpg.Pool = Depends(get_read_db_pool),
+) -> Sender:
+    if x_api_key is not None:
+        api_key = await verify_api_key(db, x_api_key)
+        if api_key is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail={
+                    "reason": "invalid_api_key",
+                    "message": "API key is invalid or revoked",
+                },
+            )
+        return Sender(api_key=api_key)
+
+    if token is None:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
+            status_code=status.HTTP_401_UNAUTHORIZED,
             detail={
-                "reason": "not_enough_project_permissions",
-                "message": "Project doesn't exist or you don't have enough permissions",
+                "reason": "invalid_credentials",
+                "message": "Could not validate credentials",
             },
+            headers={"WWW-Authenticate": "Bearer"},
         )
+    return Sender(user=await get_current_user(token, db, read_db))
+
+
+async def check_send_permissions(
+    conn: asyncpg.Connection, sender: Sender, project_uuid: UUID
+):
+    # A key can send to its own project, no access lookup needed
+    if sender.api_key is not None:
+        if sender.api_key.project_uuid != project_uuid:
+            raise not_enough_permissions()
+        return
+
+    assert sender.user is not None
+    await check_project_permissions(conn, sender.user, project_uuid)
+
+
+project_confs_cache: ProjectCache[
+    UUID, list[EmailConfInDb | TelegramConfInDb]
+] = ProjectCache(
+    settings.project_cache_size,
+    settings.project_cache_ttl_seconds,
+    lambda key: key,
+)
+
+
+async def get_cached_project_confs(
+    conn: asyncpg.Connection, project_uuid: UUID
+) -> list[EmailConfInDb | TelegramConfInDb]:
+    project_confs = project_confs_cache.get(project_uuid)
+    if project_confs is None:
+        epoch = project_confs_cache.epoch
+        project_confs = await get_project_confs(conn, project_uuid)
+        project_confs_cache.set_loaded(project_uuid, project_confs, epoch)
+    return project_confs
 
 
 @router.get("/", response_model=list[EmailConfInDb | TelegramConfInDb])
 async def list_confs(
     project_uuid: UUID,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
+    read_db: asyncpg.Pool = Depends(get_read_db_pool),
 ):
-    await check_project_permissions(conn, current_user, project_uuid)
-    return await get_project_confs(conn, project_uuid)
+    async def read_confs(
+        conn: asyncpg.Connection,
+    ) -> list[EmailConfInDb | TelegramConfInDb] | None:
+        if await get_owner_access(conn, current_user, project_uuid) is None:
+            return None
+        return await get_project_confs(conn, project_uuid)
+
+    # The project may be too new for the replica, its confs are then read
+    # from the primary along with the access
+    confs = await read_or_primary(read_db, db, read_confs)
+    if confs is None:
+        raise not_enough_permissions()
+    return confs
 
 
 @router.post("/email/", response_model=EmailConfInDb)
 async def create_email_conf(
     conf: EmailConfIn,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    await check_project_permissions(conn, current_user, conf.project_uuid)
-    email_conf_db = EmailConfInDb(
-        uuid=uuid4(), project_uuid=conf.project_uuid, email=conf.email
-    )
-    await insert_email_conf(conn, email_conf_db)
+    async with acquire(db) as conn:
+        await check_project_permissions(conn, current_user, conf.project_uuid)
+        email_conf_db = EmailConfInDb(
+            uuid=uuid4(), project_uuid=conf.project_uuid, email=conf.email
+        )
+        await insert_email_conf(conn, email_conf_db)
 
     return email_conf_db
 
@@ -71,55 +159,115 @@ async def create_email_conf(
 async def create_telegram_conf(
     conf: TelegramConfIn,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    await check_project_permissions(conn, current_user, conf.project_uuid)
-    telegram_conf_db = TelegramConfInDb(
-        uuid=uuid4(), project_uuid=conf.project_uuid, chat_id=conf.chat_id
-    )
-    await insert_telegram_conf(conn, telegram_conf_db)
+    async with acquire(db) as conn:
+        await check_project_permissions(conn, current_user, conf.project_uuid)
+        telegram_conf_db = TelegramConfInDb(
+            uuid=uuid4(), project_uuid=conf.project_uuid, chat_id=conf.chat_id
+        )
+        await insert_telegram_conf(conn, telegram_conf_db)
 
     return telegram_conf_db
 
 
+def new_status(
+    project_conf: EmailConfInDb | TelegramConfInDb, message: Message
+) -> Status:
+    if isinstance(project_conf, EmailConfInDb):
+        return EmailStatus(
+            uuid=uuid4(),
+            message_uuid=message.uuid,
+            status=MessageStatus.scheduled,
+            scheduled_ts=message.scheduled_ts,
+            email_conf_uuid=project_conf.uuid,
+            created_ts=message.created_ts,
+        )
+    return TelegramStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.scheduled,
+        scheduled_ts=message.scheduled_ts,
+        telegram_conf_uuid=project_conf.uuid,
+        created_ts=message.created_ts,
+    )
+
+
 async def send_sync(
-    conn: asyncpg.Connection,
+    db: asyncpg.Pool | asyncpg.Connection,
     project_confs: list[EmailConfInDb | TelegramConfInDb],
     message: Message,
+    timeout: float,
 ):
-    emails = []
-    chat_ids = []
-    email_statuses = []
-    telegram_statuses = []
-    for project_conf in project_confs:
-        if isinstance(project_conf, EmailConfInDb):
-            emails.append(project_conf.email)
-            email_statuses.append(
-                EmailStatus(
-                    uuid=uuid4(),
-                    message_uuid=message.uuid,
-                    status=MessageStatus.sent,
-                    email_conf_uuid=project_conf.uuid,
-                )
-            )
-        elif isinstance(project_conf, TelegramConfInDb):
-            chat_ids.append(project_conf.chat_id)
-            telegram_statuses.append(
-                TelegramStatus(
-                    uuid=uuid4(),
-                    message_uuid=message.uuid,
-                    status=MessageStatus.sent,
-                    telegram_conf_uuid=project_conf.uuid,
-                ),
+    """
+    Sends to all recipients concurrently for at most timeout seconds.
+    Recipients that failed or are not done by then are scheduled for
+    the worker, and the message stays scheduled until they are sent.
+
+    The message, its idempotency key and its statuses are stored before
+    anything is sent, so a retry finds them instead of sending again.
+    The statuses are leased to this send meanwhile, and the worker picks
+    them up if the lease runs out before the results are written back.
+    """
+    statuses = schedule_statuses(project_confs, message)
+    lease_id = f"sync-{message.uuid}"
+    async with acquire(db) as conn:
+        async with conn.transaction():
+            await insert_message(conn, message)
+            await insert_statuses(
+                conn,
+                statuses,
+                locked_until=int(time() + timeout) + settings.worker_lease_seconds,
+                worker_id=lease_id,
             )
+    if not statuses:
+        return
+
+    # No connection is held while talking to the outside world
+    sends = {
+        asyncio.create_task(send_to_conf(project_conf, message)): status
+        for project_conf, status in zip(project_confs, statuses)
+    }
+    done, pending = await asyncio.wait(sends, timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    for task, status in sends.items():
+        if task not in done:
+            # The send may still have gone out, the worker retries anyway
+            status.last_error = f"Timed out after {timeout}s"
+        elif task.exception() is not None:
+            status.last_error = repr(task.exception())
+        else:
+            status.status = MessageStatus.sent
+        if status.status == MessageStatus.scheduled:
+            # Same backoff as a failed first attempt in the worker
+            status.scheduled_ts = int(time()) + backoff_seconds(status.attempts)
+        status.attempts = 1
+
+    if all(s.status == MessageStatus.sent for s in statuses):
+        message.status = MessageStatus.sent
+
+    async with acquire(db) as conn:
+        async with conn.transaction():
+            message_keys = [(message.uuid, message.created_ts)]
+            await lock_messages(conn, message_keys)
+            await release_statuses(conn, statuses, lease_id)
+            await finalize_messages(conn, message_keys)
+            if message.status == MessageStatus.scheduled:
+                await notify_messages_scheduled(conn, message.scheduled_ts)
+
+
+def schedule_statuses(
+    project_confs: list[EmailConfInDb | TelegramConfInDb], message: Message
+) -> list[Status]:
+    statuses = [new_status(conf, message) for conf in project_confs]
 
-    await send_emails(emails, message)
-    await send_telegram(chat_ids, message)
+    # Workers only see statuses, so a message without any is done already
+    if not statuses:
+        message.status = MessageStatus.sent
 
-    message.status = MessageStatus.sent
-    await insert_message(conn, message)
-    await insert_email_statuses(conn, email_statuses)
-    await insert_telegram_statuses(conn, telegram_statuses)
+    return statuses
 
 
 async def send_async(
@@ -127,74 +275,386 @@ async def send_async(
     project_confs: list[EmailConfInDb | TelegramConfInDb],
     message: Message,
 ):
-    email_statuses = []
-    telegram_statuses = []
-    for project_conf in project_confs:
-        if isinstance(project_conf, EmailConfInDb):
-            email_statuses.append(
-                EmailStatus(
-                    uuid=uuid4(),
-                    message_uuid=message.uuid,
-                    status=MessageStatus.scheduled,
-                    email_conf_uuid=project_conf.uuid,
-                )
-            )
-        elif isinstance(project_conf, TelegramConfInDb):
-            telegram_statuses.append(
-                TelegramStatus(
-                    uuid=uuid4(),
-                    message_uuid=message.uuid,
-                    status=MessageStatus.scheduled,
-                    telegram_conf_uuid=project_conf.uuid,
-                ),
-            )
+    statuses = schedule_statuses(project_confs, message)
+
+    async with conn.transaction():
+        await insert_message(conn, message)
+        await insert_statuses(conn, statuses)
+        if message.status == MessageStatus.scheduled:
+            await notify_messages_scheduled(conn, message.scheduled_ts)
+
+
+# (project_uuid, idempotency_key) -> message, so hot retries skip the DB
+sent_messages: LRUCache[tuple[UUID, str], Message] = LRUCache(
+    settings.idempotency_cache_size
+)
 
-    await insert_message(conn, message)
-    await insert_email_statuses(conn, email_statuses)
-    await insert_telegram_statuses(conn, telegram_statuses)
+
+async def find_sent_message(
+    conn: asyncpg.Connection, project_uuid: UUID, idempotency_key: str
+) -> Message | None:
+    message = sent_messages.get((project_uuid, idempotency_key))
+    if message is not None:
+        return message
+
+    found = await get_messages_by_idempotency_keys(
+        conn, project_uuid, [idempotency_key]
+    )
+    message = found.get(idempotency_key)
+    if message is not None:
+        sent_messages.set((project_uuid, idempotency_key), message)
+    return message
 
 
 @router.post("/send/", response_model=Message)
 async def send(
     message: MessageIn,
-    current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    idempotency_key: str | None = Header(None, max_length=255),
+    sender: Sender = Depends(get_sender),
+    db: asyncpg.Pool = Depends(get_db_pool),
 ):
-    await check_project_permissions(conn, current_user, message.project_uuid)
-    project_confs = await get_project_confs(conn, message.project_uuid)
+    if idempotency_key is not None:
+        message.idempotency_key = idempotency_key
+
+    async with acquire(db) as conn:
+        await check_send_permissions(conn, sender, message.project_uuid)
+        if message.idempotency_key is not None:
+            sent = await find_sent_message(
+                conn, message.project_uuid, message.idempotency_key
+            )
+            if sent is not None:
+                return sent
+        project_confs = await get_cached_project_confs(conn, message.project_uuid)
+    now = int(time())
     message_db = Message(
         **message.dict(),
         uuid=uuid4(),
-        scheduled_ts=int(time()),
+        scheduled_ts=now,
         status=MessageStatus.scheduled,
+        created_ts=now,
     )
 
-    if message.sync:
-        await send_sync(conn, project_confs, message_db)
-    else:
-        await send_async(conn, project_confs, message_db)
+    try:
+        if message.sync:
+            timeout = message.sync_timeout or settings.sync_send_timeout_seconds
+            await send_sync(db, project_confs, message_db, timeout)
+        else:
+            async with acquire(db) as conn:
+                await send_async(conn, project_confs, message_db)
+    except asyncpg.UniqueViolationError:
+        if message.idempotency_key is None:
+            raise
+        # A concurrent retry with the same key got there first
+        async with acquire(db) as conn:
+            sent = await find_sent_message(
+                conn, message.project_uuid, message.idempotency_key
+            )
+        if sent is None:
+            raise
+        return sent
+
+    if message_db.idempotency_key is not None:
+        sent_messages.set(
+            (message_db.project_uuid, message_db.idempotency_key), message_db
+        )
 
     return message_db
 
 
+class BatchItemResult(BaseModel):
+    message: Message | None = None
+    error: dict | None = None
+
+
+@router.post("/send/batch/", response_model=list[BatchItemResult])
+async def send_batch(
+    messages: list[MessageIn],
+    sender: Sender = Depends(get_sender),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    """
+    Schedules many messages at once for the worker, sync is ignored.
+    Permissions and confs are loaded once per project, and everything is
+    written with COPY in a single transaction. Results are in request order.
+    """
+    if len(messages) > settings.send_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail={
+                "reason": "batch_too_large",
+                "message": f"At most {settings.send_batch_max_size} messages per batch",
+            },
+        )
+
+    project_confs: dict[UUID, list[EmailConfInDb | TelegramConfInDb]] = {}
+    project_errors: dict[UUID, dict] = {}
+    # (project_uuid, idempotency_key) -> message already stored or in this batch
+    known: dict[tuple[UUID, str], Message] = {}
+    async with acquire(db) as conn:
+        for project_uuid in {m.project_uuid for m in messages}:
+            try:
+                await check_send_permissions(conn, sender, project_uuid)
+            except HTTPException as e:
+                project_errors[project_uuid] = e.detail
+                continue
+            project_confs[project_uuid] = await get_cached_project_confs(
+                conn, project_uuid
+            )
+
+            keys = [
+                m.idempotency_key
+                for m in messages
+                if m.project_uuid == project_uuid and m.idempotency_key is not None
+            ]
+            if keys:
+                found = await get_messages_by_idempotency_keys(conn, project_uuid, keys)
+                for key, message in found.items():
+                    known[(project_uuid, key)] = message
+
+    now = int(time())
+    results = []
+    messages_db = []
+    statuses: list[Status] = []
+    for message in messages:
+        if message.project_uuid in project_errors:
+            results.append(BatchItemResult(error=project_errors[message.project_uuid]))
+            continue
+        key = (message.project_uuid, message.idempotency_key)
+        if message.idempotency_key is not None and key in known:
+            results.append(BatchItemResult(message=known[key]))
+            continue
+        message_db = Message(
+            **{**message.dict(), "sync": False},
+            uuid=uuid4(),
+            scheduled_ts=now,
+            status=MessageStatus.scheduled,
+            created_ts=now,
+        )
+        messages_db.append(message_db)
+        statuses.extend(
+            schedule_statuses(project_confs[message.project_uuid], message_db)
+        )
+        if message.idempotency_key is not None:
+            known[key] = message_db
+        results.append(BatchItemResult(message=message_db))
+
+    if messages_db:
+        try:
+            async with acquire(db) as conn:
+                async with conn.transaction():
+                    await copy_messages(conn, messages_db)
+                    await copy_statuses(conn, statuses)
+                    if statuses:
+                        await notify_messages_scheduled(conn, now)
+        except asyncpg.UniqueViolationError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "reason": "duplicate_idempotency_key",
+                    "message": "A concurrent request used the same idempotency keys",
+                },
+            )
+
+    return results
+
+
 class MessageResponse(BaseModel):
     message: Message
-    statuses: list[EmailStatus | TelegramStatus]
+    statuses: list[Status]
 
 
 @router.get("/message/", response_model=MessageResponse)
 async def message(
     message_uuid: UUID,
     current_user: User = Depends(get_current_user),
-    conn: asyncpg.Connection = Depends(get_db_connection),
+    db: asyncpg.Pool = Depends(get_db_pool),
+    read_db: asyncpg.Pool = Depends(get_read_db_pool),
 ):
-    message = await get_message(conn, message_uuid)
-    if message is None:
+    async def read_message(conn: asyncpg.Connection) -> MessageResponse | None:
+        message = await get_message(conn, message_uuid)
+        if message is None:
+            return None
+
+        await check_project_permissions(conn, current_user, message.project_uuid)
+
+        return MessageResponse(
+            message=message,
+            statuses=await get_statuses_for_message(
+                conn, message_uuid, message.created_ts
+            ),
+        )
+
+    # Falls back to the primary for a message just created, the replica
+    # has everything the message was written with once it has the message
+    response = await read_or_primary(read_db, db, read_message)
+    if response is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return response
+
+
+class MessagePage(BaseModel):
+    messages: list[Message]
+    # Statuses of every message on the page, if asked for
+    statuses: list[Status] | None = None
+    # Pass as cursor to get the next page, None on the last one
+    next_cursor: str | None = None
+
+
+def encode_cursor(message: Message) -> str:
+    return f"{message.scheduled_ts}_{message.uuid}"
+
 
-    await check_project_permissions(conn, current_user, message.project_uuid)
+def decode_cursor(cursor: str) -> tuple[int, UUID]:
+    try:
+        scheduled_ts, message_uuid = cursor.split("_")
+        return int(scheduled_ts), UUID(message_uuid)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"reason": "invalid_cursor", "message": "Cursor is malformed"},
+        )
+
+
+@router.get("/messages/", response_model=MessagePage)
+async def list_messages(
+    project_uuid: UUID,
+    message_status: MessageStatus | None = Query(None, alias="status"),
+    channel: Channel | None = None,
+    since_ts: int | None = None,
+    until_ts: int | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, gt=0, le=1000),
+    with_statuses: bool = False,
+    sender: Sender = Depends(get_sender),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    """
+    Project messages, newest first, paginated with an opaque cursor.
+    """
+    before = decode_cursor(cursor) if cursor is not None else None
+    async with acquire(db) as conn:
+        await check_send_permissions(conn, sender, project_uuid)
+        messages = await get_messages_page(
+            conn,
+            project_uuid,
+            limit + 1,
+            status=message_status,
+            channel=channel,
+            since_ts=since_ts,
+            until_ts=until_ts,
+            before=before,
+        )
+        messages, rest = messages[:limit], messages[limit:]
 
-    return MessageResponse(
-        message=message,
-        statuses=await get_statuses_for_message(conn, message_uuid),
+        statuses = None
+        if with_statuses and messages:
+            statuses = await get_statuses_for_messages(
+                conn, [(m.uuid, m.created_ts) for m in messages]
+            )
+        elif with_statuses:
+            statuses = []
+
+    return MessagePage(
+        messages=messages,
+        statuses=statuses,
+        next_cursor=encode_cursor(messages[-1]) if rest else None,
+    )
+
+
+async def message_events(
+    db: asyncpg.Pool | asyncpg.Connection, message_uuid: UUID
+) -> AsyncIterator[str]:
+    """
+    Yields the message with its statuses every time they change,
+    until the message is done. No connection is held in between.
+    """
+    with status_hub.subscribe(message_uuid) as changed:
+        last_data = None
+        created_ts = None
+        while True:
+            changed.clear()
+            async with acquire(db) as conn:
+                message = await get_message(conn, message_uuid, created_ts)
+                if message is None:
+                    return
+                created_ts = message.created_ts
+                statuses = await get_statuses_for_message(
+                    conn, message_uuid, created_ts
+                )
+
+            data = MessageResponse(message=message, statuses=statuses).json()
+            if data != last_data:
+                yield sse_event("message", data)
+                last_data = data
+            if message.status != MessageStatus.scheduled:
+                return
+
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+
+
+@router.get("/message/stream/")
+async def stream_message(
+    message_uuid: UUID,
+    sender: Sender = Depends(get_sender),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    """
+    Server-Sent Events with the message and its statuses, pushed as the
+    worker stores delivery results, until the message is sent or dead.
+    """
+    async with acquire(db) as conn:
+        message = await get_message(conn, message_uuid)
+        if message is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        await check_send_permissions(conn, sender, message.project_uuid)
+
+    return StreamingResponse(
+        message_events(db, message_uuid),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+
+@router.get("/dead/", response_model=list[Message])
+async def dead_messages(
+    project_uuid: UUID,
+    limit: int = Query(100, gt=0, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    async with acquire(db) as conn:
+        await check_project_permissions(conn, current_user, project_uuid)
+        return await get_dead_messages(conn, project_uuid, limit)
+
+
+@router.post("/dead/requeue/", response_model=Message)
+async def requeue_dead_message(
+    message_uuid: UUID,
+    current_user: User = Depends(get_current_user),
+    db: asyncpg.Pool = Depends(get_db_pool),
+):
+    async with acquire(db) as conn:
+        message = await get_message(conn, message_uuid)
+        if message is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        await check_project_permissions(conn, current_user, message.project_uuid)
+
+        requeued = await requeue_message(conn, message_uuid, message.created_ts)
+        if requeued is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "reason": "message_not_dead",
+                    "message": "Only dead messages can be requeued",
+                },
+            )
+        await notify_messages_scheduled(conn, requeued.scheduled_ts)
+        await notify_statuses_changed(conn, [requeued.uuid])
+
+    return requeued
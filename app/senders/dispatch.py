@@ -0,0 +1,19 @@
+from app.senders.email import send_emails
+from app.senders.models import EmailConfInDb, Message, TelegramConfInDb
+from app.senders.telegram import send_telegram
+
+
+async def send_to_conf(
+    conf: EmailConfInDb | TelegramConfInDb,
+    message: Message,
+    timeout: float | None = None,
+):
+    """
+    Delivers a message to a single recipient. timeout limits the request
+    to the channel only, waiting for rate limits or pooled connections
+    is not counted.
+    """
+    if isinstance(conf, EmailConfInDb):
+        await send_emails([conf.email], message, timeout)
+    elif isinstance(conf, TelegramConfInDb):
+        await send_telegram([conf.chat_id], message, timeout)
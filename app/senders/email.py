@@ -1,23 +1,155 @@
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
+import asyncio
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from time import monotonic
+
+import aiosmtplib
 from pydantic import EmailStr
 
 from app.senders.models import Message
 from app.settings import settings
 
-email_sender_conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_username),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_TLS=settings.mail_tls,
-    MAIL_SSL=settings.mail_ssl,
-    USE_CREDENTIALS=settings.mail_use_credentials,
-    VALIDATE_CERTS=settings.mail_validatae_certs,
-)
-
-
-async def send_emails(emails: list[EmailStr], message: Message):
-    schema = MessageSchema(subject=message.title, recipients=emails, body=message.text)
-    fm = FastMail(email_sender_conf)
-    await fm.send_message(schema)
+
+class SMTPPool:
+    """
+    Long-lived logged-in SMTP connections shared by all senders.
+    Idle connections are kept alive with NOOP, and broken ones are
+    replaced with fresh ones on the next acquire.
+    """
+
+    def __init__(self, size: int, keepalive_interval: float):
+        self.size = size
+        self.keepalive_interval = keepalive_interval
+        self.idle: asyncio.Queue[tuple[aiosmtplib.SMTP, float]] = asyncio.Queue()
+        self.created = 0
+        self.closed = False
+        self.keepalive_task: asyncio.Task | None = None
+
+    async def connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=settings.mail_server,
+            port=settings.mail_port,
+            use_tls=settings.mail_ssl,
+            validate_certs=settings.mail_validatae_certs,
+        )
+        await client.connect()
+        if settings.mail_tls:
+            await client.starttls()
+        if settings.mail_use_credentials:
+            await client.login(settings.mail_username, settings.mail_password)
+        return client
+
+    async def is_alive(self, client: aiosmtplib.SMTP, last_used: float) -> bool:
+        if not client.is_connected:
+            return False
+        if monotonic() - last_used < self.keepalive_interval:
+            return True
+        try:
+            await client.noop()
+        except (aiosmtplib.SMTPException, OSError):
+            return False
+        return True
+
+    async def discard(self, client: aiosmtplib.SMTP, broken: bool = False):
+        """
+        Healthy connections say QUIT, broken ones are just closed: their
+        session state is unknown, and a cancelled send can't wait anyway.
+        """
+        self.created -= 1
+        if broken:
+            client.close()
+            return
+        try:
+            await client.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            client.close()
+
+    async def acquire(self) -> aiosmtplib.SMTP:
+        if self.closed:
+            raise RuntimeError("SMTP pool is closed")
+        if self.keepalive_task is None:
+            self.keepalive_task = asyncio.create_task(self.keepalive())
+
+        while True:
+            try:
+                client, last_used = self.idle.get_nowait()
+            except asyncio.QueueEmpty:
+                if self.created < self.size:
+                    self.created += 1
+                    try:
+                        return await self.connect()
+                    except BaseException:
+                        self.created -= 1
+                        raise
+                client, last_used = await self.idle.get()
+
+            if await self.is_alive(client, last_used):
+                return client
+            await self.discard(client, broken=True)
+
+    async def release(self, client: aiosmtplib.SMTP, broken: bool = False):
+        if broken or self.closed:
+            await self.discard(client, broken)
+        else:
+            self.idle.put_nowait((client, monotonic()))
+
+    @asynccontextmanager
+    async def connection(self):
+        client = await self.acquire()
+        try:
+            yield client
+        except BaseException:
+            # The session state is unknown after a failed transaction
+            await self.release(client, broken=True)
+            raise
+        else:
+            await self.release(client)
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            for _ in range(self.idle.qsize()):
+                try:
+                    client, last_used = self.idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if monotonic() - last_used < self.keepalive_interval:
+                    self.idle.put_nowait((client, last_used))
+                elif await self.is_alive(client, last_used):
+                    self.idle.put_nowait((client, monotonic()))
+                else:
+                    await self.discard(client, broken=True)
+
+    async def close(self):
+        self.closed = True
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+        while not self.idle.empty():
+            client, _ = self.idle.get_nowait()
+            await self.discard(client)
+
+
+smtp_pool = SMTPPool(settings.mail_pool_size, settings.mail_keepalive_seconds)
+
+
+def build_email(emails: list[EmailStr], message: Message) -> EmailMessage:
+    email = EmailMessage()
+    email["From"] = settings.mail_username
+    email["To"] = ", ".join(emails)
+    email["Subject"] = message.title
+    email.set_content(message.text)
+    return email
+
+
+async def send_emails(
+    emails: list[EmailStr], message: Message, timeout: float | None = None
+):
+    email = build_email(emails, message)
+    try:
+        async with smtp_pool.connection() as client:
+            await asyncio.wait_for(client.send_message(email), timeout)
+    except aiosmtplib.SMTPServerDisconnected:
+        # Server dropped an idle connection between keepalives, retry once
+        async with smtp_pool.connection() as client:
+            await asyncio.wait_for(client.send_message(email), timeout)
@@ -1,7 +1,8 @@
 from enum import Enum
+from time import time
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
 
 class EmailConfBase(BaseModel):
@@ -33,11 +34,23 @@ class MessageIn(BaseModel):
     title: str
     text: str
     sync: bool
+    # Seconds a sync send may take, recipients not done by then
+    # are left to the worker
+    sync_timeout: float | None = Field(None, gt=0, le=60)
+    # Retries with the same key return the original message
+    idempotency_key: str | None = Field(None, max_length=255)
 
 
 class MessageStatus(str, Enum):
     scheduled = "scheduled"
     sent = "sent"
+    # Gave up after max attempts, can be requeued through the API
+    dead = "dead"
+
+
+class Channel(str, Enum):
+    email = "email"
+    telegram = "telegram"
 
 
 class Message(MessageIn):
@@ -45,17 +58,43 @@ class Message(MessageIn):
     scheduled_ts: int
     status: MessageStatus
     attempts: int = 0
+    # Partition key, never changes once stored
+    created_ts: int = Field(default_factory=lambda: int(time()))
 
 
 class StatusBase(BaseModel):
     uuid: UUID
     message_uuid: UUID
     status: MessageStatus
+    scheduled_ts: int | None = None
+    attempts: int = 0
+    last_error: str | None = None
+    # Same as the created_ts of the message
+    created_ts: int = Field(default_factory=lambda: int(time()))
 
 
 class EmailStatus(StatusBase):
     email_conf_uuid: UUID
 
+    @property
+    def channel(self) -> Channel:
+        return Channel.email
+
+    @property
+    def conf_uuid(self) -> UUID:
+        return self.email_conf_uuid
+
 
 class TelegramStatus(StatusBase):
     telegram_conf_uuid: UUID
+
+    @property
+    def channel(self) -> Channel:
+        return Channel.telegram
+
+    @property
+    def conf_uuid(self) -> UUID:
+        return self.telegram_conf_uuid
+
+
+Status = EmailStatus | TelegramStatus
@@ -3,27 +3,44 @@ from uuid import UUID
 
 import asyncpg
 
-from app.senders.models import (EmailConfInDb, EmailStatus, Message,
-                                MessageStatus, TelegramConfInDb,
-                                TelegramStatus)
+from app.projects.cache import notify_project_changed
+from app.senders.models import (
+    Channel,
+    EmailConfInDb,
+    EmailStatus,
+    Message,
+    MessageStatus,
+    Status,
+    TelegramConfInDb,
+    TelegramStatus,
+)
+
+MESSAGES_CHANNEL = "herodotus_messages"
+STATUSES_CHANNEL = "herodotus_statuses"
+
+Delivery = tuple[EmailStatus, EmailConfInDb] | tuple[TelegramStatus, TelegramConfInDb]
 
 
 async def insert_email_conf(conn: asyncpg.Connection, conf: EmailConfInDb):
-    await conn.execute(
-        "INSERT INTO email_conf(uuid, project_uuid, email) VALUES ($1, $2, $3)",
-        conf.uuid,
-        conf.project_uuid,
-        conf.email,
-    )
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO email_conf(uuid, project_uuid, email) VALUES ($1, $2, $3)",
+            conf.uuid,
+            conf.project_uuid,
+            conf.email,
+        )
+        await notify_project_changed(conn, conf.project_uuid)
 
 
 async def insert_telegram_conf(conn: asyncpg.Connection, conf: TelegramConfInDb):
-    await conn.execute(
-        "INSERT INTO telegram_conf(uuid, project_uuid, chat_id) VALUES ($1, $2, $3)",
-        conf.uuid,
-        conf.project_uuid,
-        conf.chat_id,
-    )
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO telegram_conf(uuid, project_uuid, chat_id) VALUES ($1, $2, $3)",
+            conf.uuid,
+            conf.project_uuid,
+            conf.chat_id,
+        )
+        await notify_project_changed(conn, conf.project_uuid)
 
 
 async def get_email_conf(
@@ -68,12 +85,15 @@ async def get_project_confs(
     return [*email_confs, *telegram_confs]
 
 
+INSERT_MESSAGE = """
+    INSERT INTO messages(uuid, project_uuid, title, text, sync, scheduled_ts, status, attempts, idempotency_key, created_ts)
+        VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10);
+    """
+
+
 async def insert_message(conn: asyncpg.Connection, message: Message):
     await conn.execute(
-        """
-        INSERT INTO messages(uuid, project_uuid, title, text, sync, scheduled_ts, status, attempts)
-            VALUES($1, $2, $3, $4, $5, $6, $7, $8);
-        """,
+        INSERT_MESSAGE,
         message.uuid,
         message.project_uuid,
         message.title,
@@ -82,135 +102,574 @@ async def insert_message(conn: asyncpg.Connection, message: Message):
         message.scheduled_ts,
         message.status,
         message.attempts,
+        message.idempotency_key,
+        message.created_ts,
+    )
+    if message.idempotency_key is not None:
+        await conn.execute(
+            """
+            INSERT INTO idempotency_keys(project_uuid, idempotency_key, message_uuid, created_ts)
+                VALUES($1, $2, $3, $4);
+            """,
+            message.project_uuid,
+            message.idempotency_key,
+            message.uuid,
+            message.created_ts,
+        )
+
+
+async def copy_messages(conn: asyncpg.Connection, messages: list[Message]):
+    await conn.copy_records_to_table(
+        "messages",
+        columns=[
+            "uuid",
+            "project_uuid",
+            "title",
+            "text",
+            "sync",
+            "scheduled_ts",
+            "status",
+            "attempts",
+            "idempotency_key",
+            "created_ts",
+        ],
+        records=[
+            (
+                message.uuid,
+                message.project_uuid,
+                message.title,
+                message.text,
+                message.sync,
+                message.scheduled_ts,
+                message.status.value,
+                message.attempts,
+                message.idempotency_key,
+                message.created_ts,
+            )
+            for message in messages
+        ],
+    )
+    keys = [
+        (m.project_uuid, m.idempotency_key, m.uuid, m.created_ts)
+        for m in messages
+        if m.idempotency_key is not None
+    ]
+    if keys:
+        await conn.copy_records_to_table(
+            "idempotency_keys",
+            columns=["project_uuid", "idempotency_key", "message_uuid", "created_ts"],
+            records=keys,
+        )
+
+
+async def notify_messages_scheduled(conn: asyncpg.Connection, scheduled_ts: int):
+    """
+    Wakes up listening workers. Delivered on commit of the current transaction.
+    """
+    await conn.execute("SELECT pg_notify($1, $2)", MESSAGES_CHANNEL, str(scheduled_ts))
+
+
+NOTIFY_STATUSES_CHANGED = "SELECT pg_notify($1, m::text) FROM unnest($2::uuid[]) AS m"
+
+
+async def notify_statuses_changed(conn: asyncpg.Connection, message_uuids: list[UUID]):
+    """
+    Wakes up status streams of the messages, one notification per message.
+    Delivered on commit of the current transaction.
+    """
+    await conn.execute(
+        NOTIFY_STATUSES_CHANGED,
+        STATUSES_CHANNEL,
+        message_uuids,
     )
 
 
-async def get_message(conn: asyncpg.Connection, message_uuid: UUID) -> Message | None:
-    raw: asyncpg.Record = await conn.fetchrow(
-        "SELECT * FROM messages WHERE uuid = $1", message_uuid
+GET_NEXT_SCHEDULED_TS = """
+    SELECT min(scheduled_ts) FROM deliveries
+        WHERE status = $1 AND scheduled_ts > $2
+    """
+
+
+async def get_next_scheduled_ts(conn: asyncpg.Connection) -> int | None:
+    return await conn.fetchval(
+        GET_NEXT_SCHEDULED_TS,
+        MessageStatus.scheduled,
+        int(time()),
     )
+
+
+GET_MESSAGE = "SELECT * FROM messages WHERE uuid = $1"
+GET_MESSAGE_IN_PARTITION = "SELECT * FROM messages WHERE uuid = $1 AND created_ts = $2"
+
+
+async def get_message(
+    conn: asyncpg.Connection, message_uuid: UUID, created_ts: int | None = None
+) -> Message | None:
+    """
+    Pass created_ts whenever known, so only its partition is looked at.
+    """
+    if created_ts is None:
+        raw = await conn.fetchrow(GET_MESSAGE, message_uuid)
+    else:
+        raw = await conn.fetchrow(GET_MESSAGE_IN_PARTITION, message_uuid, created_ts)
     if raw is None:
         return None
 
     return Message(**raw)
 
 
-async def insert_email_statuses(
-    conn: asyncpg.Connection, email_statuses: list[EmailStatus]
-):
-    await conn.executemany(
+async def get_messages_by_idempotency_keys(
+    conn: asyncpg.Connection, project_uuid: UUID, keys: list[str]
+) -> dict[str, Message]:
+    raw = await conn.fetch(
         """
-        INSERT INTO email_status(uuid, message_uuid, email_conf_uuid, status)
-            VALUES ($1, $2, $3, $4);
+        SELECT messages.*
+        FROM idempotency_keys
+            JOIN messages ON messages.uuid = idempotency_keys.message_uuid
+                AND messages.created_ts = idempotency_keys.created_ts
+        WHERE idempotency_keys.project_uuid = $1
+            AND idempotency_keys.idempotency_key = ANY($2)
         """,
+        project_uuid,
+        keys,
+    )
+    return {m["idempotency_key"]: Message(**m) for m in raw}
+
+
+GET_MESSAGES = """
+    SELECT * FROM messages WHERE uuid = ANY($1) AND created_ts = ANY($2)
+    """
+
+
+def split_message_keys(
+    message_keys: list[tuple[UUID, int]],
+) -> tuple[list[UUID], list[int]]:
+    """
+    Messages are looked up by (uuid, created_ts), created_ts only narrows
+    down the partitions to look at.
+    """
+    return [k[0] for k in message_keys], list({k[1] for k in message_keys})
+
+
+async def get_messages(
+    conn: asyncpg.Connection, message_keys: list[tuple[UUID, int]]
+) -> dict[UUID, Message]:
+    raw = await conn.fetch(GET_MESSAGES, *split_message_keys(message_keys))
+    return {m["uuid"]: Message(**m) for m in raw}
+
+
+def status_from_row(raw: asyncpg.Record) -> Status:
+    fields = dict(
+        uuid=raw["uuid"],
+        message_uuid=raw["message_uuid"],
+        status=raw["status"],
+        scheduled_ts=raw["scheduled_ts"],
+        attempts=raw["attempts"],
+        last_error=raw["last_error"],
+        created_ts=raw["created_ts"],
+    )
+    if raw["channel"] == Channel.email:
+        return EmailStatus(**fields, email_conf_uuid=raw["conf_uuid"])
+    return TelegramStatus(**fields, telegram_conf_uuid=raw["conf_uuid"])
+
+
+INSERT_STATUSES = """
+    INSERT INTO deliveries(uuid, message_uuid, channel, conf_uuid, status, scheduled_ts, attempts, created_ts, locked_until, worker_id)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10);
+    """
+
+
+async def insert_statuses(
+    conn: asyncpg.Connection,
+    statuses: list[Status],
+    locked_until: int | None = None,
+    worker_id: str | None = None,
+):
+    """
+    Statuses can be stored already leased to worker_id, workers won't
+    claim them before locked_until.
+    """
+    await conn.executemany(
+        INSERT_STATUSES,
         [
             (
-                email_status.uuid,
-                email_status.message_uuid,
-                email_status.email_conf_uuid,
-                email_status.status,
+                status.uuid,
+                status.message_uuid,
+                status.channel,
+                status.conf_uuid,
+                status.status,
+                status.scheduled_ts,
+                status.attempts,
+                status.created_ts,
+                locked_until,
+                worker_id,
             )
-            for email_status in email_statuses
+            for status in statuses
         ],
     )
 
 
-async def update_email_status(conn: asyncpg.Connection, email_status: EmailStatus):
-    await conn.execute(
+async def copy_statuses(conn: asyncpg.Connection, statuses: list[Status]):
+    await conn.copy_records_to_table(
+        "deliveries",
+        columns=[
+            "uuid",
+            "message_uuid",
+            "channel",
+            "conf_uuid",
+            "status",
+            "scheduled_ts",
+            "attempts",
+            "created_ts",
+        ],
+        records=[
+            (
+                status.uuid,
+                status.message_uuid,
+                status.channel.value,
+                status.conf_uuid,
+                status.status.value,
+                status.scheduled_ts,
+                status.attempts,
+                status.created_ts,
+            )
+            for status in statuses
+        ],
+    )
+
+
+GET_STATUSES_FOR_MESSAGE = (
+    "SELECT * FROM deliveries WHERE message_uuid = $1 ORDER BY channel"
+)
+GET_STATUSES_FOR_MESSAGE_IN_PARTITION = """
+    SELECT * FROM deliveries WHERE message_uuid = $1 AND created_ts = $2
+    ORDER BY channel
+    """
+
+
+async def get_statuses_for_message(
+    conn: asyncpg.Connection, message_uuid: UUID, created_ts: int | None = None
+) -> list[Status]:
+    """
+    Pass the created_ts of the message whenever known, see get_message.
+    """
+    if created_ts is None:
+        raw = await conn.fetch(GET_STATUSES_FOR_MESSAGE, message_uuid)
+    else:
+        raw = await conn.fetch(
+            GET_STATUSES_FOR_MESSAGE_IN_PARTITION, message_uuid, created_ts
+        )
+    return [status_from_row(s) for s in raw]
+
+
+async def get_statuses_for_messages(
+    conn: asyncpg.Connection, message_keys: list[tuple[UUID, int]]
+) -> list[Status]:
+    raw = await conn.fetch(
         """
-        UPDATE email_status SET (message_uuid, email_conf_uuid, status) = 
-            ($1, $2, $3)
-        WHERE uuid = $4;
+        SELECT * FROM deliveries
+            WHERE message_uuid = ANY($1) AND created_ts = ANY($2)
+        ORDER BY channel
+        """,
+        *split_message_keys(message_keys),
+    )
+    return [status_from_row(s) for s in raw]
+
+
+async def get_messages_page(
+    conn: asyncpg.Connection,
+    project_uuid: UUID,
+    limit: int,
+    status: MessageStatus | None = None,
+    channel: Channel | None = None,
+    since_ts: int | None = None,
+    until_ts: int | None = None,
+    before: tuple[int, UUID] | None = None,
+) -> list[Message]:
+    """
+    Newest messages first. The next page starts before the
+    (scheduled_ts, uuid) of the last message, so any page is a single
+    index range scan no matter how deep it is.
+    """
+    conditions = ["project_uuid = $1"]
+    args: list = [project_uuid]
+
+    def arg(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    if status is not None:
+        conditions.append(f"status = {arg(status)}")
+    if since_ts is not None:
+        conditions.append(f"scheduled_ts >= {arg(since_ts)}")
+    if until_ts is not None:
+        conditions.append(f"scheduled_ts < {arg(until_ts)}")
+    if before is not None:
+        conditions.append(
+            f"(scheduled_ts, uuid) < ({arg(before[0])}, {arg(before[1])})"
+        )
+    if channel is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM deliveries "
+            f"WHERE message_uuid = messages.uuid AND channel = {arg(channel)})"
+        )
+
+    raw = await conn.fetch(
+        f"""
+        SELECT * FROM messages
+            WHERE {" AND ".join(conditions)}
+        ORDER BY scheduled_ts DESC, uuid DESC
+        LIMIT {arg(limit)}
         """,
-        email_status.message_uuid,
-        email_status.email_conf_uuid,
-        email_status.status,
-        email_status.uuid,
+        *args,
     )
 
+    return [Message(**m) for m in raw]
+
 
-async def insert_telegram_statuses(
-    conn: asyncpg.Connection, telegram_statuses: list[TelegramStatus]
+CLAIM_DELIVERIES = """
+    WITH claimed AS (
+        UPDATE deliveries SET (locked_until, worker_id) = ($3, $4)
+        WHERE uuid IN (
+            SELECT uuid FROM deliveries
+                WHERE status = $1 AND scheduled_ts <= $2
+                    AND (locked_until IS NULL OR locked_until <= $2)
+                    AND channel = ANY($6)
+            ORDER BY scheduled_ts
+            LIMIT $5
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    )
+    SELECT claimed.*,
+        COALESCE(email_conf.project_uuid, telegram_conf.project_uuid) AS project_uuid,
+        email_conf.email,
+        telegram_conf.chat_id
+    FROM claimed
+        LEFT JOIN email_conf
+            ON claimed.channel = 'email' AND email_conf.uuid = claimed.conf_uuid
+        LEFT JOIN telegram_conf
+            ON claimed.channel = 'telegram' AND telegram_conf.uuid = claimed.conf_uuid
+    ORDER BY claimed.scheduled_ts
+    """
+
+
+async def claim_deliveries(
+    conn: asyncpg.Connection,
+    worker_id: str,
+    lease_seconds: int,
+    limit: int = 100,
+    channels: list[Channel] | None = None,
+) -> list[Delivery]:
+    """
+    Atomically leases up to limit due statuses of the given channels (all
+    by default), together with their confs. Rows locked by another claim
+    are skipped, and leases that ran out (crashed worker) are claimable
+    again. Statuses whose conf is gone are marked dead right away.
+    """
+    now = int(time())
+    raw = await conn.fetch(
+        CLAIM_DELIVERIES,
+        MessageStatus.scheduled,
+        now,
+        now + lease_seconds,
+        worker_id,
+        limit,
+        list(Channel) if channels is None else channels,
+    )
+
+    deliveries: list[Delivery] = []
+    orphans: list[Status] = []
+    for r in raw:
+        status = status_from_row(r)
+        if r["project_uuid"] is None:
+            # Conf deleted in between, there is nowhere to send to
+            status.status = MessageStatus.dead
+            status.last_error = "Conf was deleted"
+            orphans.append(status)
+        elif isinstance(status, EmailStatus):
+            conf = EmailConfInDb(
+                uuid=r["conf_uuid"], project_uuid=r["project_uuid"], email=r["email"]
+            )
+            deliveries.append((status, conf))
+        else:
+            conf = TelegramConfInDb(
+                uuid=r["conf_uuid"],
+                project_uuid=r["project_uuid"],
+                chat_id=r["chat_id"],
+            )
+            deliveries.append((status, conf))
+
+    if orphans:
+        message_keys = list({(s.message_uuid, s.created_ts) for s in orphans})
+        async with conn.transaction():
+            await lock_messages(conn, message_keys)
+            await release_statuses(conn, orphans, worker_id)
+            await finalize_messages(conn, message_keys)
+
+    return deliveries
+
+
+RELEASE_STATUSES = """
+    UPDATE deliveries SET (status, scheduled_ts, attempts, last_error, locked_until, worker_id) = 
+        ($1, $2, $3, $4, NULL, NULL)
+    WHERE uuid = $5 AND created_ts = $6 AND worker_id = $7;
+    """
+
+
+async def release_statuses(
+    conn: asyncpg.Connection, statuses: list[Status], worker_id: str
 ):
+    """
+    Stores delivery results and drops the lease. Rows whose lease has
+    expired and was claimed by another worker are left alone.
+    """
     await conn.executemany(
-        """
-        INSERT INTO telegram_status(uuid, message_uuid, telegram_conf_uuid, status)
-            VALUES ($1, $2, $3, $4);
-        """,
+        RELEASE_STATUSES,
         [
             (
-                telegram_status.uuid,
-                telegram_status.message_uuid,
-                telegram_status.telegram_conf_uuid,
-                telegram_status.status,
+                status.status,
+                status.scheduled_ts,
+                status.attempts,
+                status.last_error,
+                status.uuid,
+                status.created_ts,
+                worker_id,
             )
-            for telegram_status in telegram_statuses
+            for status in statuses
         ],
     )
 
 
-async def update_telegram_status(
-    conn: asyncpg.Connection, telegram_status: TelegramStatus
-):
-    await conn.execute(
-        """
-        UPDATE telegram_status SET (message_uuid, telegram_conf_uuid, status) = 
-            ($1, $2, $3)
-        WHERE uuid = $4;
-        """,
-        telegram_status.message_uuid,
-        telegram_status.telegram_conf_uuid,
-        telegram_status.status,
-        telegram_status.uuid,
-    )
+LOCK_MESSAGES = """
+    SELECT 1 FROM messages WHERE uuid = ANY($1) AND created_ts = ANY($2)
+    ORDER BY uuid FOR UPDATE
+    """
 
 
-async def get_statuses_for_message(
-    conn: asyncpg.Connection, message_uuid: UUID
-) -> list[EmailStatus | TelegramStatus]:
-    email_raw = await conn.fetch(
-        "SELECT * FROM email_status WHERE message_uuid = $1", message_uuid
+async def lock_messages(conn: asyncpg.Connection, message_keys: list[tuple[UUID, int]]):
+    """
+    Serializes concurrent result write-backs for the same messages,
+    so the last one always sees every other status when finalizing.
+    Must be called inside a transaction.
+    """
+    await conn.execute(
+        LOCK_MESSAGES,
+        *split_message_keys(message_keys),
     )
-    email_statuses = [EmailStatus(**s) for s in email_raw]
 
-    telegram_raw = await conn.fetch(
-        "SELECT * FROM telegram_status WHERE message_uuid = $1", message_uuid
-    )
-    telegram_statuses = [TelegramStatus(**s) for s in telegram_raw]
 
-    return [*email_statuses, *telegram_statuses]
+FINALIZE_MESSAGES = """
+    UPDATE messages SET status = CASE
+        WHEN EXISTS (
+            SELECT 1 FROM deliveries
+                WHERE message_uuid = messages.uuid AND status = $3
+                    AND created_ts = ANY($5)
+                    AND created_ts = messages.created_ts
+        ) THEN $3 ELSE $2 END
+    WHERE uuid = ANY($1) AND created_ts = ANY($5) AND status = $4
+        AND NOT EXISTS (
+            SELECT 1 FROM deliveries
+                WHERE message_uuid = messages.uuid AND status = $4
+                    AND created_ts = ANY($5)
+                    AND created_ts = messages.created_ts
+        )
+    """
+
+
+async def finalize_messages(
+    conn: asyncpg.Connection, message_keys: list[tuple[UUID, int]]
+):
+    """
+    Marks messages without scheduled statuses left as sent, or as dead
+    if some of their statuses gave up.
+    """
+    message_uuids, created_ts = split_message_keys(message_keys)
+    await conn.execute(
+        FINALIZE_MESSAGES,
+        message_uuids,
+        MessageStatus.sent,
+        MessageStatus.dead,
+        MessageStatus.scheduled,
+        created_ts,
+    )
 
 
-async def get_unprocessed_messages(
-    conn: asyncpg.Connection, limit: int = 100
+async def get_dead_messages(
+    conn: asyncpg.Connection, project_uuid: UUID, limit: int = 100
 ) -> list[Message]:
     raw = await conn.fetch(
         """
         SELECT * FROM messages
-            WHERE sync = false AND status = $1 AND scheduled_ts <= $2
-        ORDER BY scheduled_ts
+            WHERE project_uuid = $1 AND status = $2
+        ORDER BY scheduled_ts DESC
         LIMIT $3
         """,
-        MessageStatus.scheduled,
-        time(),
+        project_uuid,
+        MessageStatus.dead,
         limit,
     )
 
     return [Message(**m) for m in raw]
 
 
-async def update_message(conn: asyncpg.Connection, message: Message):
-    await conn.execute(
+async def requeue_message(
+    conn: asyncpg.Connection, message_uuid: UUID, created_ts: int
+) -> Message | None:
+    """
+    Gives dead statuses of a dead message a fresh set of attempts.
+    """
+    now = int(time())
+    async with conn.transaction():
+        raw = await conn.fetchrow(
+            """
+            UPDATE messages SET (status, scheduled_ts, attempts) = ($1, $2, 0)
+            WHERE uuid = $3 AND created_ts = $5 AND status = $4
+            RETURNING *
+            """,
+            MessageStatus.scheduled,
+            now,
+            message_uuid,
+            MessageStatus.dead,
+            created_ts,
+        )
+        if raw is None:
+            return None
+
+        await conn.execute(
+            """
+            UPDATE deliveries SET (status, scheduled_ts, attempts, last_error) =
+                ($1, $2, 0, NULL)
+            WHERE message_uuid = $3 AND created_ts = $5 AND status = $4
+            """,
+            MessageStatus.scheduled,
+            now,
+            message_uuid,
+            MessageStatus.dead,
+            created_ts,
+        )
+
+    return Message(**raw)
+
+
+async def delete_expired_messages(
+    conn: asyncpg.Connection, project_uuid: UUID, before_ts: int, limit: int
+) -> int:
+    """
+    Deletes up to limit messages of a project created before before_ts,
+    their deliveries and idempotency keys go with them. Returns how many
+    were deleted, call again until it is less than limit.
+    """
+    result = await conn.execute(
         """
-        UPDATE messages SET (project_uuid, title, text, sync, scheduled_ts, status) = 
-            ($1, $2, $3, $4, $5, $6)
-        WHERE uuid = $7;
+        DELETE FROM messages WHERE (uuid, created_ts) IN (
+            SELECT uuid, created_ts FROM messages
+            WHERE project_uuid = $1 AND created_ts < $2
+            LIMIT $3
+        )
         """,
-        message.project_uuid,
-        message.title,
-        message.text,
-        message.sync,
-        message.scheduled_ts,
-        message.status,
-        message.uuid,
+        project_uuid,
+        before_ts,
+        limit,
     )
+    return int(result.split()[-1])
@@ -0,0 +1,54 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Iterator
+from uuid import UUID
+
+from app.db import listener
+from app.senders.queries import STATUSES_CHANNEL
+
+
+class StatusHub:
+    """
+    Wakes up the status streams of a message whenever the worker commits
+    results for it. Every stream of the process shares the one LISTEN
+    connection, the notification only carries the message uuid.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[UUID, set[asyncio.Event]] = {}
+
+    @contextmanager
+    def subscribe(self, message_uuid: UUID) -> Iterator[asyncio.Event]:
+        changed = asyncio.Event()
+        self.subscribers.setdefault(message_uuid, set()).add(changed)
+        try:
+            yield changed
+        finally:
+            events = self.subscribers[message_uuid]
+            events.discard(changed)
+            if not events:
+                del self.subscribers[message_uuid]
+
+    def on_notify(self, payload: str):
+        try:
+            message_uuid = UUID(payload)
+        except ValueError:
+            return
+        for changed in self.subscribers.get(message_uuid, ()):
+            changed.set()
+
+    def wake_all(self):
+        for events in self.subscribers.values():
+            for changed in events:
+                changed.set()
+
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+status_hub = StatusHub()
+
+# Streams re-read their message after a reconnect, as notifications
+# may have been missed meanwhile
+listener.add_channel(STATUSES_CHANNEL, status_hub.on_notify, status_hub.wake_all)
@@ -1,21 +1,125 @@
 import asyncio
+from time import monotonic
 
 import aiogram
+from aiogram.exceptions import TelegramRetryAfter
 
 from app.senders.models import Message
 from app.settings import settings
 
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity and self.paused_until <= monotonic()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                delay = self.paused_until - monotonic()
+                if delay <= 0:
+                    self.refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+
+
+class TelegramSender:
+    """
+    Sends through a single shared bot session, keeping under the global
+    and per-chat Telegram limits. A flood error delays only the chat it
+    was reported for.
+    """
+
+    def __init__(
+        self,
+        bot: aiogram.Bot,
+        global_rate: float,
+        chat_rate: float,
+        concurrency: int,
+        max_retries: int,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self.chat_buckets = {
+                    k: b for k, b in self.chat_buckets.items() if not b.is_idle()
+                }
+            bucket = TokenBucket(self.chat_rate, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def send(self, chat_id: int, text: str, timeout: float | None = None):
+        """
+        timeout limits each request to Telegram, not the waits for the
+        rate limits.
+        """
+        bucket = self.chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            # Wait for the chat first, so a slow chat doesn't hold global tokens
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            async with self.semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        self.bot.send_message(
+                            chat_id=chat_id, text=text, parse_mode="HTML"
+                        ),
+                        timeout,
+                    )
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    bucket.pause(e.retry_after)
+
+    async def close(self):
+        await self.bot.session.close()
+
+
 bot = aiogram.Bot(settings.telegram_token)
 
+telegram_sender = TelegramSender(
+    bot,
+    global_rate=settings.telegram_global_rate,
+    chat_rate=settings.telegram_chat_rate,
+    concurrency=settings.telegram_concurrency,
+    max_retries=settings.telegram_max_retries,
+)
+
 
-async def send_telegram(chat_ids: list[int], message: Message):
+async def send_telegram(
+    chat_ids: list[int], message: Message, timeout: float | None = None
+):
+    text = f"<strong>{message.title}</strong>\n\n{message.text}"
     await asyncio.gather(
-        *[
-            bot.send_message(
-                chat_id=chat_id,
-                text=f"<strong>{message.title}</strong>\n\n{message.text}",
-                parse_mode="HTML",
-            )
-            for chat_id in chat_ids
-        ]
+        *[telegram_sender.send(chat_id, text, timeout) for chat_id in chat_ids]
     )
@@ -6,8 +6,27 @@ from pydantic import BaseSettings, Field, PostgresDsn
 class Settings(BaseSettings):
     auth_key: str = ""
     pg_dsn: str = ""
+    pg_pool_min_size: int = 10
+    pg_pool_max_size: int = 10
+    pg_statement_cache_size: int = 100
+    pg_max_inactive_connection_lifetime_seconds: float = 300
+    pg_command_timeout_seconds: float | None = None
+    # Session GUCs of every pool connection, e.g. {"statement_timeout": "5s"}
+    pg_server_settings: dict[str, str] = {}
+    pg_pool_stats_log_seconds: float = 60
+    # Read-only endpoints go to these when healthy
+    pg_replica_dsns: list[str] = []
+    pg_replica_max_lag_seconds: float = 5
+    pg_replica_check_seconds: float = 2
     jwt_alogrithm: str = "HS256"
     access_token_expires_minutes: int = 30
+    user_cache_size: int = 10000
+    user_cache_ttl_seconds: float = 60
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32
+    project_cache_size: int = 10000
+    project_cache_ttl_seconds: float = 300
+    api_key_secret: str = ""
 
     mail_username: str = ""
     mail_password: str = ""
@@ -17,8 +36,42 @@ class Settings(BaseSettings):
     mail_ssl: bool = True
     mail_use_credentials: bool = True
     mail_validatae_certs: bool = True
+    mail_pool_size: int = 4
+    mail_keepalive_seconds: float = 30
 
     telegram_token: str = ""
+    telegram_global_rate: float = 30
+    telegram_chat_rate: float = 1
+    telegram_concurrency: int = 30
+    telegram_max_retries: int = 3
+
+    sync_send_timeout_seconds: float = 10
+    send_batch_max_size: int = 10000
+    idempotency_cache_size: int = 10000
+
+    worker_batch_size: int = 100
+    worker_lease_seconds: int = 300
+    worker_concurrency: int = 50
+    worker_flush_size: int = 500
+    worker_flush_interval_seconds: float = 1.0
+    worker_send_timeout_seconds: float = 30
+    worker_max_attempts: int = 10
+    worker_max_backoff_seconds: int = 3600
+    worker_breaker_failure_threshold: int = 5
+    worker_breaker_reset_seconds: float = 30
+
+    # Must match the partitions already created, see the time partitions
+    # migration
+    partition_interval_days: int = 7
+    partition_premake: int = 26
+    retention_days: int = 365
+    retention_delete_batch_size: int = 10000
+    maintenance_interval_seconds: float = 3600
+    # Workers run the maintenance job, any number of them can
+    worker_run_maintenance: bool = True
+    # Expired partitions are exported here as gzipped CSV before being
+    # dropped, nothing is exported if empty
+    archive_dir: str = ""
 
     class Config:
         env_file = ".env"
@@ -26,7 +79,9 @@ class Settings(BaseSettings):
 
         fields = {
             "auth_key": {"env": "AUTH_KEY"},
+            "api_key_secret": {"env": "API_KEY_SECRET"},
             "pg_dsn": {"env": "POSTGRES_DSN"},
+            "pg_replica_dsns": {"env": "POSTGRES_REPLICA_DSNS"},
             "mail_username": {"env": "MAIL_USERNAME"},
             "mail_password": {"env": "MAIL_PASSWORD"},
             "telegram_token": {"env": "TELEGRAM_TOKEN"},
@@ -8,26 +8,13 @@ from httpx import AsyncClient
 from jose import jwt
 
 from app.auth.api import (TokenData, authenticate_user, create_access_token,
-                          get_current_user, pwd_context, verify_password)
+                          get_current_user)
+from app.auth.hashing import pwd_context
 from app.settings import settings
 from app.users.models import UserInDB
 from app.users.queries import get_user_by_username, insert_user
 
 
-def test_verify_password_correct():
-    pwd = "password"
-    hashed_pwd = pwd_context.hash(pwd)
-
-    assert verify_password(pwd, hashed_pwd)
-
-
-def test_verify_password_incorrect():
-    pwd = "password"
-    changed_hashed_pwd = pwd_context.hash("hello")
-
-    assert not verify_password(pwd, changed_hashed_pwd)
-
-
 @pytest.mark.anyio
 async def test_authenticate_user(db_conn: asyncpg.Connection):
     user = UserInDB(
@@ -71,7 +58,7 @@ async def test_get_current_user(db_conn: asyncpg.Connection):
     await insert_user(db_conn, user)
     token = create_access_token(TokenData(username=user.username), timedelta(days=1))
 
-    current_user = await get_current_user(token, db_conn)
+    current_user = await get_current_user(token, db_conn, db_conn)
     assert current_user is not None
 
     assert current_user.uuid == user.uuid
@@ -85,7 +72,7 @@ async def test_get_current_user_invalid_token(db_conn: asyncpg.Connection):
     await insert_user(db_conn, user)
 
     with pytest.raises(HTTPException) as einfo:
-        await get_current_user("not_valid_jwt", db_conn)
+        await get_current_user("not_valid_jwt", db_conn, db_conn)
 
     assert einfo.value.detail["reason"] == "invalid_credentials"
 
@@ -95,7 +82,7 @@ async def test_get_current_user_not_exists(db_conn: asyncpg.Connection):
     token = create_access_token(TokenData(username="test"), timedelta(days=1))
 
     with pytest.raises(HTTPException) as einfo:
-        await get_current_user(token, db_conn)
+        await get_current_user(token, db_conn, db_conn)
 
     assert einfo.value.detail["reason"] == "invalid_credentials"
 
@@ -112,7 +99,7 @@ async def test_register(client: AsyncClient, db_conn: asyncpg.Connection):
     user = await get_user_by_username(db_conn, "test")
     assert user is not None
     assert user.username == "test"
-    assert verify_password("test", user.password_hash)
+    assert pwd_context.verify("test", user.password_hash)
     assert response_body["uuid"] == str(user.uuid)
 
 
@@ -163,3 +150,36 @@ async def test_get_access_token_incorrect_credentials(
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
     data = response.json()
     assert data["detail"]["reason"] == "incorrect_credentials"
+
+
+@pytest.mark.anyio
+async def test_get_current_user_cached(db_conn: asyncpg.Connection):
+    user = UserInDB(
+        username="test", uuid=uuid4(), password_hash=pwd_context.hash("pwd")
+    )
+    await insert_user(db_conn, user)
+    token = create_access_token(
+        TokenData(username=user.username, uuid=user.uuid), timedelta(days=1)
+    )
+    current_user = await get_current_user(token, db_conn, db_conn)
+    assert current_user.uuid == user.uuid
+
+    await db_conn.execute("DELETE FROM users WHERE uuid = $1", user.uuid)
+    cached_user = await get_current_user(token, db_conn, db_conn)
+    assert cached_user == current_user
+
+
+@pytest.mark.anyio
+async def test_get_current_user_uuid_mismatch(db_conn: asyncpg.Connection):
+    user = UserInDB(
+        username="test", uuid=uuid4(), password_hash=pwd_context.hash("pwd")
+    )
+    await insert_user(db_conn, user)
+    token = create_access_token(
+        TokenData(username=user.username, uuid=uuid4()), timedelta(days=1)
+    )
+
+    with pytest.raises(HTTPException) as einfo:
+        await get_current_user(token, db_conn, db_conn)
+
+    assert einfo.value.detail["reason"] == "invalid_credentials"
@@ -0,0 +1,28 @@
+import pytest
+from fastapi import HTTPException, status
+
+from app.auth.hashing import PasswordHasher
+
+
+@pytest.mark.anyio
+async def test_password_hasher():
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    hashed = await hasher.hash("password")
+
+    assert await hasher.verify("password", hashed)
+    assert not await hasher.verify("hello", hashed)
+    assert hasher.stats().pending == 0
+    hasher.close()
+
+
+@pytest.mark.anyio
+async def test_password_hasher_admission_limit():
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    hasher.pending = 1
+
+    with pytest.raises(HTTPException) as einfo:
+        await hasher.hash("password")
+
+    assert einfo.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert hasher.stats().rejected == 1
+    assert hasher.stats().saturation == 1
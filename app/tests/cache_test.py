@@ -0,0 +1,28 @@
+from app.cache import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_ttl(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr("app.cache.monotonic", lambda: now)
+    cache: LRUCache[str, int] = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+
+    now = 109.0
+    assert cache.get("a") == 1
+
+    now = 110.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
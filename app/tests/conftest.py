@@ -4,8 +4,8 @@ import asyncpg
 import pytest
 from httpx import AsyncClient
 
-from app.auth.api import pwd_context
-from app.db import Database, get_db_connection
+from app.auth.hashing import pwd_context
+from app.db import Database, get_db_pool, get_read_db_pool
 from app.main import create_app
 from app.users.models import User, UserIn
 
@@ -68,7 +68,8 @@ async def app(db_conn: asyncpg.Connection, db: Database):
     app = create_app(use_db=db)
     # We can't let app create it's own connections, because we need to
     # have control to rollback all changes
-    app.dependency_overrides[get_db_connection] = lambda: db_conn
+    app.dependency_overrides[get_db_pool] = lambda: db_conn
+    app.dependency_overrides[get_read_db_pool] = lambda: db_conn
     return app
 
 
@@ -0,0 +1,110 @@
+import asyncio
+
+import asyncpg
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from app.db import (
+    Database,
+    Listener,
+    PoolStats,
+    Replica,
+    acquire,
+    close_pool,
+    create_pool,
+    get_pool_stats,
+)
+from app.settings import settings
+
+
+@pytest.mark.anyio
+async def test_pool_metrics():
+    pool = await create_pool(settings.pg_dsn)
+    try:
+        async with acquire(pool):
+            stats = get_pool_stats(pool)
+            assert stats is not None
+            assert stats.in_use == 1
+            assert stats.acquired == 1
+            assert stats.waiting == 0
+
+        stats = get_pool_stats(pool)
+        assert stats is not None
+        assert stats.in_use == 0
+        assert stats.idle == stats.size
+    finally:
+        await close_pool(pool)
+
+    assert get_pool_stats(pool) is None
+
+
+@pytest.mark.anyio
+async def test_pool_stats_endpoint(client: AsyncClient):
+    response = await client.get("/db/pool/")
+    assert response.status_code == status.HTTP_200_OK
+    assert PoolStats(**response.json()).max_size == settings.pg_pool_max_size
+
+
+@pytest.mark.anyio
+async def test_replica_check():
+    replica = Replica(settings.pg_dsn)
+    try:
+        # The primary is never behind itself
+        await replica.check(max_lag_seconds=1, timeout=10)
+        assert replica.healthy
+        assert replica.lag_seconds == 0
+    finally:
+        await replica.close()
+
+    unreachable = Replica("postgresql://herodotus@127.0.0.1:1/herodotus")
+    await unreachable.check(max_lag_seconds=1, timeout=10)
+    assert not unreachable.healthy
+
+
+def test_read_pool_skips_unhealthy_replicas():
+    db = Database()
+    db.pool = object()
+    healthy, lagging = Replica("healthy"), Replica("lagging")
+    healthy.pool, lagging.pool = object(), object()
+    healthy.healthy = True
+    db.replicas = [healthy, lagging]
+
+    assert db.read_pool() is healthy.pool
+    assert db.read_pool() is healthy.pool
+
+    healthy.healthy = False
+    assert db.read_pool() is db.pool
+
+
+@pytest.mark.anyio
+async def test_listener_survives_unexpected_errors(monkeypatch):
+    attempts = 0
+    resyncs = 0
+
+    async def connect(*args, **kwargs):
+        nonlocal attempts
+        attempts += 1
+        raise RuntimeError("unexpected")
+
+    def on_resync():
+        nonlocal resyncs
+        resyncs += 1
+
+    monkeypatch.setattr(asyncpg, "connect", connect)
+    monkeypatch.setattr("app.db.LISTEN_MAX_RECONNECT_SECONDS", 0)
+    listener = Listener()
+    listener.add_channel("test", lambda payload: None, on_resync)
+    listener.reconnect_delay = 0
+    listener.start()
+    try:
+        for _ in range(100):
+            if attempts >= 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await listener.close()
+
+    # Kept retrying instead of the task dying on the first error
+    assert attempts >= 3
+    assert resyncs >= 2
@@ -0,0 +1,29 @@
+from uuid import uuid4
+
+from app.projects.cache import ProjectCache, invalidate_project
+
+
+def test_project_cache_invalidate():
+    project_uuid, other_uuid = uuid4(), uuid4()
+    cache: ProjectCache[tuple, int] = ProjectCache(10, None, lambda key: key[0])
+    cache.set((project_uuid, 1), 1)
+    cache.set((project_uuid, 2), 2)
+    cache.set((other_uuid, 1), 3)
+
+    invalidate_project(project_uuid)
+    assert cache.get((project_uuid, 1)) is None
+    assert cache.get((project_uuid, 2)) is None
+    assert cache.get((other_uuid, 1)) == 3
+
+
+def test_project_cache_skips_values_loaded_before_invalidation():
+    project_uuid = uuid4()
+    cache: ProjectCache[tuple, int] = ProjectCache(10, None, lambda key: key[0])
+
+    epoch = cache.epoch
+    invalidate_project(uuid4())
+    cache.set_loaded((project_uuid, 1), 1, epoch)
+    assert cache.get((project_uuid, 1)) is None
+
+    cache.set_loaded((project_uuid, 1), 1, cache.epoch)
+    assert cache.get((project_uuid, 1)) == 1
@@ -4,8 +4,10 @@ import asyncpg
 import pytest
 from fastapi import status
 
-from app.projects.models import Project, ProjectIn
-from app.projects.queries import (get_project_access, get_project_by_uuid,
+from app.projects.keys import hash_api_key
+from app.projects.models import ApiKey, ApiKeyCreated, Project, ProjectIn
+from app.projects.queries import (get_active_api_key_by_hash, get_api_key,
+                                  get_project_access, get_project_by_uuid,
                                   insert_project)
 from app.tests.conftest import AuthClient
 from app.users.models import User
@@ -49,3 +51,53 @@ async def test_projects_list(
 
     assert project1.dict() == projects["project1"].dict()
     assert project2.dict() == projects["project2"].dict()
+
+
+@pytest.mark.anyio
+async def test_api_keys(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+
+    response = await auth_client.post(
+        "/projects/keys/",
+        user=user,
+        json={"project_uuid": str(project.uuid), "name": "service"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    created = ApiKeyCreated(**response.json())
+    assert created.project_uuid == project.uuid
+    assert "key_hash" not in response.json()
+
+    api_key_db = await get_active_api_key_by_hash(db_conn, hash_api_key(created.key))
+    assert api_key_db is not None
+    assert api_key_db.uuid == created.uuid
+
+    response = await auth_client.get(
+        f"/projects/keys/?project_uuid={project.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert [ApiKey(**k).uuid for k in response.json()] == [created.uuid]
+
+    response = await auth_client.post(
+        f"/projects/keys/revoke/?key_uuid={created.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert ApiKey(**response.json()).revoked_ts is not None
+
+    revoked = await get_api_key(db_conn, created.uuid)
+    assert revoked is not None and revoked.revoked_ts is not None
+    assert await get_active_api_key_by_hash(db_conn, revoked.key_hash) is None
+
+
+@pytest.mark.anyio
+async def test_api_keys_permission(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    response = await auth_client.post(
+        "/projects/keys/",
+        user=user,
+        json={"project_uuid": str(uuid4()), "name": "service"},
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
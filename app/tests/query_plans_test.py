@@ -0,0 +1,272 @@
+"""
+Query plan regression suite: checks that no query in queries.py has to
+scan a big table sequentially. Queries are captured by running the query
+functions against a recording connection, then EXPLAINed on the real one.
+
+Tables are seeded for realistic statistics, but test volumes are still
+small enough for a seq scan to be cheapest sometimes. So seq scans are
+disabled, and one showing up means no index can serve the query.
+
+Lookups by message also have to stay within the partitions of the
+message's period.
+"""
+
+import json
+import re
+from contextlib import nullcontext
+from hashlib import md5
+from time import time
+from typing import Any, Awaitable, Callable
+from uuid import UUID
+
+import asyncpg
+import pytest
+
+from app.projects.queries import get_project_access, get_projects_for_user
+from app.queue.maintenance import DAY_SECONDS, create_partitions
+from app.senders.models import Channel, EmailStatus, MessageStatus
+from app.senders.queries import (
+    claim_deliveries,
+    delete_expired_messages,
+    finalize_messages,
+    get_dead_messages,
+    get_email_conf,
+    get_message,
+    get_messages,
+    get_messages_by_idempotency_keys,
+    get_messages_page,
+    get_next_scheduled_ts,
+    get_project_confs,
+    get_statuses_for_message,
+    get_statuses_for_messages,
+    get_telegram_conf,
+    lock_messages,
+    release_statuses,
+)
+from app.users.models import User
+from app.users.queries import get_user_by_username
+
+USERS = 1000
+PROJECTS = 1000
+CONFS = 2000
+MESSAGES = 10000
+START_TS = 1000000000
+
+# <table>_YYYYMMDD
+PARTITION_RE = re.compile(r"\w+_\d{8}")
+
+BIG_TABLES = {
+    "users",
+    "projects",
+    "project_access",
+    "email_conf",
+    "telegram_conf",
+    "messages",
+    "deliveries",
+    "idempotency_keys",
+}
+
+
+def seeded_uuid(prefix: str, i: int) -> UUID:
+    """
+    Same as md5(prefix || i)::uuid in the seed SQL.
+    """
+    return UUID(md5(f"{prefix}{i}".encode()).hexdigest())
+
+
+SEED_SQL = f"""
+INSERT INTO users(uuid, username, password_hash)
+    SELECT md5('u' || i)::uuid, 'plan_user_' || i, 'x'
+    FROM generate_series(1, {USERS}) i;
+INSERT INTO projects(uuid, name, description)
+    SELECT md5('p' || i)::uuid, 'project', ''
+    FROM generate_series(1, {PROJECTS}) i;
+INSERT INTO project_access(uuid, user_uuid, project_uuid, type)
+    SELECT md5('a' || i)::uuid, md5('u' || i)::uuid, md5('p' || i)::uuid, 'owner'
+    FROM generate_series(1, {PROJECTS}) i;
+INSERT INTO email_conf(uuid, project_uuid, email)
+    SELECT md5('e' || i)::uuid, md5('p' || (i % {PROJECTS} + 1))::uuid,
+        'user' || i || '@test.ru'
+    FROM generate_series(1, {CONFS}) i;
+INSERT INTO telegram_conf(uuid, project_uuid, chat_id)
+    SELECT md5('t' || i)::uuid, md5('p' || (i % {PROJECTS} + 1))::uuid, i
+    FROM generate_series(1, {CONFS}) i;
+SELECT create_time_partitions(parent, {START_TS}, {START_TS + MESSAGES}, 604800)
+    FROM unnest(ARRAY['messages', 'deliveries']) parent;
+INSERT INTO messages(uuid, project_uuid, title, text, sync, scheduled_ts, status,
+        attempts, idempotency_key, created_ts)
+    SELECT md5('m' || i)::uuid, md5('p' || (i % {PROJECTS} + 1))::uuid, 'title',
+        'text', false, {START_TS} + i,
+        CASE WHEN i % 50 = 0 THEN 'scheduled' WHEN i % 100 = 1 THEN 'dead'
+            ELSE 'sent' END,
+        0, 'key' || i, {START_TS} + i
+    FROM generate_series(1, {MESSAGES}) i;
+INSERT INTO idempotency_keys(project_uuid, idempotency_key, message_uuid, created_ts)
+    SELECT project_uuid, idempotency_key, uuid, created_ts FROM messages
+    WHERE created_ts > {START_TS} AND created_ts <= {START_TS + MESSAGES};
+INSERT INTO deliveries(uuid, message_uuid, channel, conf_uuid, status,
+        scheduled_ts, attempts, created_ts)
+    SELECT md5('es' || i)::uuid, md5('m' || i)::uuid, 'email',
+        md5('e' || (i % {CONFS} + 1))::uuid, status, scheduled_ts, 0, created_ts
+    FROM generate_series(1, {MESSAGES}) i
+        JOIN messages ON messages.uuid = md5('m' || i)::uuid;
+INSERT INTO deliveries(uuid, message_uuid, channel, conf_uuid, status,
+        scheduled_ts, attempts, created_ts)
+    SELECT md5('ts' || i)::uuid, md5('m' || i)::uuid, 'telegram',
+        md5('t' || (i % {CONFS} + 1))::uuid, status, scheduled_ts, 0, created_ts
+    FROM generate_series(1, {MESSAGES}) i
+        JOIN messages ON messages.uuid = md5('m' || i)::uuid;
+ANALYZE users, projects, project_access, email_conf, telegram_conf, messages,
+    deliveries, idempotency_keys;
+"""
+
+
+class RecordingConnection:
+    """
+    Stands in for a connection and records every query instead of
+    running it. Results are always empty.
+    """
+
+    def __init__(self):
+        self.queries: list[tuple[str, tuple]] = []
+
+    async def fetch(self, query: str, *args) -> list:
+        self.queries.append((query, args))
+        return []
+
+    async def fetchrow(self, query: str, *args) -> None:
+        self.queries.append((query, args))
+        return None
+
+    async def fetchval(self, query: str, *args) -> None:
+        self.queries.append((query, args))
+        return None
+
+    async def execute(self, query: str, *args) -> str:
+        self.queries.append((query, args))
+        # Only ever parsed for its row count
+        return "DELETE 0"
+
+    async def executemany(self, query: str, args: list[tuple]):
+        self.queries.append((query, tuple(args[0])))
+
+    def transaction(self):
+        return nullcontext()
+
+
+def scanned_partitions(plan: dict) -> set[str]:
+    partitions = set()
+    relation = plan.get("Relation Name", "")
+    if PARTITION_RE.fullmatch(relation):
+        partitions.add(relation)
+    for child in plan.get("Plans", []):
+        partitions |= scanned_partitions(child)
+    return partitions
+
+
+def seq_scans(plan: dict) -> list[str]:
+    scans = []
+    if plan["Node Type"] == "Seq Scan":
+        relation = plan["Relation Name"]
+        # Partitions are named <table>_YYYYMMDD
+        if relation in BIG_TABLES or relation.rsplit("_", 1)[0] in BIG_TABLES:
+            scans.append(relation)
+    for child in plan.get("Plans", []):
+        scans.extend(seq_scans(child))
+    return scans
+
+
+project_uuid = seeded_uuid("p", 1)
+message_uuid = seeded_uuid("m", 1000)
+message_key = (message_uuid, START_TS + 1000)
+user = User(username="plan_user_1", uuid=seeded_uuid("u", 1))
+email_status = EmailStatus(
+    uuid=seeded_uuid("es", 1000),
+    message_uuid=message_uuid,
+    status=MessageStatus.sent,
+    email_conf_uuid=seeded_uuid("e", 1001),
+    created_ts=START_TS + 1000,
+)
+
+QUERIES: dict[str, Callable[[Any], Awaitable]] = {
+    "get_user_by_username": lambda c: get_user_by_username(c, user.username),
+    "get_project_access": lambda c: get_project_access(c, project_uuid, user),
+    "get_projects_for_user": lambda c: get_projects_for_user(c, user),
+    "get_project_confs": lambda c: get_project_confs(c, project_uuid),
+    "get_email_conf": lambda c: get_email_conf(c, seeded_uuid("e", 1)),
+    "get_telegram_conf": lambda c: get_telegram_conf(c, seeded_uuid("t", 1)),
+    "get_message": lambda c: get_message(c, message_uuid),
+    "get_message_in_partition": lambda c: get_message(c, *message_key),
+    "get_messages": lambda c: get_messages(c, [message_key]),
+    "get_messages_by_idempotency_keys": lambda c: get_messages_by_idempotency_keys(
+        c, project_uuid, ["key1000"]
+    ),
+    "get_statuses_for_message": lambda c: get_statuses_for_message(c, message_uuid),
+    "get_statuses_for_message_in_partition": lambda c: get_statuses_for_message(
+        c, *message_key
+    ),
+    "get_statuses_for_messages": lambda c: get_statuses_for_messages(c, [message_key]),
+    "get_messages_page": lambda c: get_messages_page(c, project_uuid, 100),
+    "get_messages_page_filtered": lambda c: get_messages_page(
+        c,
+        project_uuid,
+        100,
+        status=MessageStatus.sent,
+        channel=Channel.email,
+        before=(START_TS + MESSAGES, message_uuid),
+    ),
+    "get_dead_messages": lambda c: get_dead_messages(c, project_uuid),
+    "claim_deliveries": lambda c: claim_deliveries(c, "worker", 300),
+    "get_next_scheduled_ts": get_next_scheduled_ts,
+    "release_statuses": lambda c: release_statuses(c, [email_status], "worker"),
+    "lock_messages": lambda c: lock_messages(c, [message_key]),
+    "finalize_messages": lambda c: finalize_messages(c, [message_key]),
+    "delete_expired_messages": lambda c: delete_expired_messages(
+        c, project_uuid, START_TS + 1000, 100
+    ),
+}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("name", QUERIES)
+async def test_query_uses_indexes(name: str, db_conn: asyncpg.Connection):
+    await db_conn.execute(SEED_SQL)
+    await db_conn.execute("SET LOCAL enable_seqscan = off")
+    recording = RecordingConnection()
+    await QUERIES[name](recording)
+    assert recording.queries
+
+    for query, args in recording.queries:
+        raw_plan = await db_conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        plan = json.loads(raw_plan)[0]["Plan"]
+        assert seq_scans(plan) == [], f"{name}: {query}"
+
+
+# Looked up by (uuid, created_ts), only the partitions of that period count
+PRUNED_QUERIES = [
+    "get_message_in_partition",
+    "get_messages",
+    "get_statuses_for_message_in_partition",
+    "get_statuses_for_messages",
+    "release_statuses",
+    "lock_messages",
+    "finalize_messages",
+]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("name", PRUNED_QUERIES)
+async def test_query_skips_partitions(name: str, db_conn: asyncpg.Connection):
+    await db_conn.execute(SEED_SQL)
+    # Partitions for the coming months are there besides the seeded one
+    await create_partitions(db_conn, int(time()), int(time()) + 90 * DAY_SECONDS)
+    recording = RecordingConnection()
+    await QUERIES[name](recording)
+
+    for query, args in recording.queries:
+        raw_plan = await db_conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        plan = json.loads(raw_plan)[0]["Plan"]
+        partitions = scanned_partitions(plan)
+        assert partitions, f"{name}: {query}"
+        tables = [p.rsplit("_", 1)[0] for p in partitions]
+        assert len(tables) == len(set(tables)), f"{name}: {partitions}"
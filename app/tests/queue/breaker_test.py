@@ -0,0 +1,65 @@
+from time import monotonic, time
+
+from app.queue.breaker import BreakerState, CircuitBreaker
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == BreakerState.open
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == BreakerState.closed
+
+
+def test_breaker_half_open_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert breaker.state == BreakerState.half_open
+    # Only a single probe while half-open
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == BreakerState.open
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BreakerState.closed
+    assert breaker.allow()
+
+
+def test_breaker_ready_does_not_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    assert breaker.ready()
+    breaker.record_failure()
+    assert not breaker.ready()
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.ready()
+    assert breaker.state == BreakerState.open
+    assert breaker.allow()
+    # The probe is out
+    assert not breaker.ready()
+
+
+def test_breaker_half_open_retry_ts():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.opened_at = monotonic() - 60
+    breaker.state = BreakerState.open
+    assert breaker.allow()
+
+    # Skipped deliveries wait for the probe instead of coming back each second
+    assert breaker.retry_ts() >= time() + 60
@@ -0,0 +1,132 @@
+import gzip
+from time import time
+from uuid import uuid4
+
+import asyncpg
+import pytest
+from pydantic import EmailStr
+
+from app.db import Database
+from app.projects.models import Project
+from app.projects.queries import insert_project
+from app.queue.maintenance import (
+    DAY_SECONDS,
+    MAINTENANCE_LOCK_ID,
+    create_partitions,
+    get_partitions,
+    run_maintenance,
+)
+from app.senders.models import EmailConfInDb, EmailStatus, Message, MessageStatus
+from app.senders.queries import (
+    get_message,
+    get_messages_by_idempotency_keys,
+    get_statuses_for_message,
+    insert_email_conf,
+    insert_message,
+    insert_statuses,
+)
+from app.settings import settings
+from app.users.models import UserInDB
+from app.users.queries import insert_user
+
+
+async def create_project(
+    conn: asyncpg.Connection, retention_days: int | None = None
+) -> Project:
+    user = UserInDB(username=f"test_{uuid4().hex}", password_hash="test", uuid=uuid4())
+    await insert_user(conn, user)
+    project = Project(
+        name="project", description="", uuid=uuid4(), retention_days=retention_days
+    )
+    await insert_project(conn, project, user)
+    return project
+
+
+async def create_message(
+    conn: asyncpg.Connection, project: Project, created_ts: int
+) -> Message:
+    message = Message(
+        uuid=uuid4(),
+        project_uuid=project.uuid,
+        title="title",
+        text="text",
+        sync=False,
+        scheduled_ts=created_ts,
+        status=MessageStatus.sent,
+        idempotency_key=uuid4().hex,
+        created_ts=created_ts,
+    )
+    await insert_message(conn, message)
+    conf = EmailConfInDb(
+        email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(conn, conf)
+    status = EmailStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.sent,
+        email_conf_uuid=conf.uuid,
+        created_ts=created_ts,
+    )
+    await insert_statuses(conn, [status])
+    return message
+
+
+@pytest.mark.anyio
+async def test_project_retention(db_conn: asyncpg.Connection):
+    now = int(time())
+    old_ts = now - 3 * DAY_SECONDS
+    await create_partitions(db_conn, old_ts, now)
+    short = await create_project(db_conn, retention_days=1)
+    default = await create_project(db_conn)
+    expired = await create_message(db_conn, short, old_ts)
+    kept = await create_message(db_conn, short, now)
+    kept_default = await create_message(db_conn, default, old_ts)
+
+    assert await run_maintenance(db_conn, now)
+
+    assert await get_message(db_conn, expired.uuid) is None
+    assert await get_statuses_for_message(db_conn, expired.uuid) == []
+    assert (
+        await get_messages_by_idempotency_keys(
+            db_conn, short.uuid, [expired.idempotency_key]
+        )
+        == {}
+    )
+    assert await get_message(db_conn, kept.uuid) == kept
+    assert await get_message(db_conn, kept_default.uuid) == kept_default
+
+
+@pytest.mark.anyio
+async def test_expired_partitions_archived_and_dropped(
+    db_conn: asyncpg.Connection, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    now = int(time())
+    old_ts = now - (settings.retention_days + 30) * DAY_SECONDS
+    await create_partitions(db_conn, old_ts, old_ts)
+    project = await create_project(db_conn)
+    message = await create_message(db_conn, project, old_ts)
+    partition = next(
+        p for p in await get_partitions(db_conn, "messages") if p.from_ts <= old_ts
+    )
+
+    assert await run_maintenance(db_conn, now)
+
+    assert await get_message(db_conn, message.uuid) is None
+    assert partition not in await get_partitions(db_conn, "messages")
+    # Future partitions are there for new messages
+    assert any(p.from_ts > now for p in await get_partitions(db_conn, "messages"))
+    with gzip.open(tmp_path / f"{partition.name}.csv.gz", "rt") as archive:
+        assert str(message.uuid) in archive.read()
+
+
+@pytest.mark.anyio
+async def test_maintenance_locked(db: Database, db_conn: asyncpg.Connection):
+    assert db.pool is not None
+    async with db.pool.acquire() as other:
+        await other.execute("SELECT pg_advisory_lock($1)", MAINTENANCE_LOCK_ID)
+        try:
+            assert not await run_maintenance(db_conn)
+        finally:
+            await other.execute("SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_ID)
@@ -0,0 +1,203 @@
+import asyncio
+from time import time
+from uuid import uuid4
+
+import asyncpg
+import pytest
+
+from app.queue.worker import (
+    INITIAL_TIMEOUT_SECONDS,
+    DeliveryResult,
+    Worker,
+    backoff_seconds,
+)
+from app.senders.models import (
+    Channel,
+    EmailConfInDb,
+    Message,
+    MessageStatus,
+    TelegramConfInDb,
+    TelegramStatus,
+)
+from app.senders.queries import (
+    get_message,
+    get_statuses_for_message,
+    insert_message,
+    insert_statuses,
+    insert_telegram_conf,
+)
+from app.settings import settings
+from app.tests.senders.senders_queries_test import (
+    create_email_conf,
+    create_email_status,
+    create_project,
+    make_message,
+)
+
+
+class FakeSender:
+    """
+    Stands in for send_to_conf, failing while fail is set.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent: list[tuple[EmailConfInDb | TelegramConfInDb, Message]] = []
+
+    async def __call__(self, conf, message, timeout=None):
+        if self.fail:
+            raise ConnectionError("channel is down")
+        self.sent.append((conf, message))
+
+
+@pytest.fixture()
+def sender(monkeypatch: pytest.MonkeyPatch) -> FakeSender:
+    sender = FakeSender()
+    monkeypatch.setattr("app.queue.worker.send_to_conf", sender)
+    return sender
+
+
+async def create_scheduled(conn: asyncpg.Connection, **status_fields):
+    project = await create_project(conn)
+    conf = await create_email_conf(conn, project)
+    message = make_message(project)
+    await insert_message(conn, message)
+    status = await create_email_status(conn, message, conf, **status_fields)
+    return message, status
+
+
+async def process_claimed(worker: Worker) -> list[DeliveryResult]:
+    results = []
+    while not worker.queue.empty():
+        delivery, message = worker.queue.get_nowait()
+        results.append(await worker.process_status(delivery, message))
+    return results
+
+
+def test_backoff_seconds(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "worker_max_backoff_seconds", 100)
+    for attempts in range(10):
+        backoff = min(100, INITIAL_TIMEOUT_SECONDS * 2**attempts)
+        assert backoff / 2 <= backoff_seconds(attempts) <= backoff
+
+    # Huge attempt counts don't overflow the cap
+    assert backoff_seconds(1000) <= 100
+
+
+@pytest.mark.anyio
+async def test_worker_delivers(db_conn: asyncpg.Connection, sender: FakeSender):
+    message, status = await create_scheduled(db_conn)
+    worker = Worker(db_conn)
+
+    assert await worker.fill_queue() == 1
+    assert await process_claimed(worker) == [DeliveryResult.sent]
+    assert [m.uuid for _, m in sender.sent] == [message.uuid]
+
+    # Nothing is stored before the flush
+    (stored,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert stored.status == MessageStatus.scheduled
+
+    await worker.results.flush()
+    (stored,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert stored.status == MessageStatus.sent
+    assert stored.attempts == 1
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.sent
+    assert await worker.fill_queue() == 0
+
+
+@pytest.mark.anyio
+async def test_worker_retry_wakeup(
+    db_conn: asyncpg.Connection,
+    sender: FakeSender,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr("app.queue.worker.backoff_seconds", lambda attempts: 1)
+    sender.fail = True
+    message, _ = await create_scheduled(db_conn)
+    worker = Worker(db_conn)
+
+    assert await worker.fill_queue() == 1
+    assert await process_claimed(worker) == [DeliveryResult.failed]
+    # Still leased, a wakeup now would find nothing to claim
+    assert worker.next_wakeup_ts is None
+
+    waiting = asyncio.create_task(worker.wait_for_work())
+    await asyncio.sleep(0)
+    await worker.results.flush()
+    (stored,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert stored.status == MessageStatus.scheduled
+    assert stored.attempts == 1
+    assert stored.last_error is not None
+    assert worker.next_wakeup_ts == stored.scheduled_ts
+
+    # The producer wakes up for the retry instead of the poll interval
+    await asyncio.wait_for(waiting, 3)
+    sender.fail = False
+    assert await worker.fill_queue() == 1
+    assert await process_claimed(worker) == [DeliveryResult.sent]
+
+
+@pytest.mark.anyio
+async def test_worker_dead_letters_at_max_attempts(
+    db_conn: asyncpg.Connection,
+    sender: FakeSender,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "worker_max_attempts", 2)
+    sender.fail = True
+    message, _ = await create_scheduled(db_conn, attempts=1)
+    worker = Worker(db_conn)
+
+    assert await worker.fill_queue() == 1
+    assert await process_claimed(worker) == [DeliveryResult.failed]
+    await worker.results.flush()
+
+    (stored,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert stored.status == MessageStatus.dead
+    assert stored.attempts == 2
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.dead
+    # A dead status is never retried
+    assert worker.next_wakeup_ts is None
+    assert await worker.fill_queue() == 0
+
+
+@pytest.mark.anyio
+async def test_worker_skips_channels_with_open_breaker(
+    db_conn: asyncpg.Connection, sender: FakeSender
+):
+    message, email_status = await create_scheduled(db_conn)
+    telegram_conf = TelegramConfInDb(
+        chat_id=1, project_uuid=message.project_uuid, uuid=uuid4()
+    )
+    await insert_telegram_conf(db_conn, telegram_conf)
+    telegram = TelegramStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.scheduled,
+        scheduled_ts=message.scheduled_ts,
+        telegram_conf_uuid=telegram_conf.uuid,
+        created_ts=message.created_ts,
+    )
+    await insert_statuses(db_conn, [telegram])
+
+    worker = Worker(db_conn)
+    breaker = worker.breakers[Channel.email]
+    for _ in range(settings.worker_breaker_failure_threshold):
+        breaker.record_failure()
+
+    # Email stays in the table unleased, telegram goes out
+    assert await worker.fill_queue() == 1
+    assert await process_claimed(worker) == [DeliveryResult.sent]
+    assert [conf for conf, _ in sender.sent] == [telegram_conf]
+    row = await db_conn.fetchrow(
+        "SELECT locked_until FROM deliveries WHERE uuid = $1", email_status.uuid
+    )
+    assert row["locked_until"] is None
+
+    # Back for email once the breaker lets it through again
+    assert worker.next_wakeup_ts is not None
+    assert worker.next_wakeup_ts >= time() + settings.worker_breaker_reset_seconds - 1
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.senders.email import SMTPPool
+
+
+class FakeSMTP:
+    def __init__(self):
+        self.is_connected = True
+        self.quit_called = False
+        self.close_called = False
+
+    async def noop(self):
+        pass
+
+    async def quit(self):
+        self.quit_called = True
+        self.is_connected = False
+
+    def close(self):
+        self.close_called = True
+        self.is_connected = False
+
+
+class FakeSMTPPool(SMTPPool):
+    def __init__(self, size: int):
+        super().__init__(size, keepalive_interval=60)
+        self.clients: list[FakeSMTP] = []
+
+    async def connect(self):
+        client = FakeSMTP()
+        self.clients.append(client)
+        return client
+
+
+@pytest.mark.anyio
+async def test_smtp_pool_reuses_connections():
+    pool = FakeSMTPPool(size=2)
+    try:
+        async with pool.connection() as first:
+            pass
+        async with pool.connection() as second:
+            pass
+
+        assert first is second
+        assert len(pool.clients) == 1
+    finally:
+        await pool.close()
+
+    assert first.quit_called
+
+
+@pytest.mark.anyio
+async def test_smtp_pool_discards_on_error():
+    pool = FakeSMTPPool(size=1)
+    try:
+        with pytest.raises(RuntimeError):
+            async with pool.connection() as broken:
+                raise RuntimeError("send failed")
+
+        # Closed without a QUIT round trip on a connection in unknown state
+        assert broken.close_called
+        assert not broken.quit_called
+        assert pool.created == 0
+
+        async with pool.connection() as client:
+            assert client is not broken
+    finally:
+        await pool.close()
+
+
+@pytest.mark.anyio
+async def test_smtp_pool_max_size():
+    pool = FakeSMTPPool(size=1)
+    try:
+        async with pool.connection() as first:
+            waiting = asyncio.create_task(pool.acquire())
+            await asyncio.sleep(0.01)
+            # Waits for the only connection instead of opening another
+            assert not waiting.done()
+            assert len(pool.clients) == 1
+
+        second = await asyncio.wait_for(waiting, 1)
+        assert second is first
+        await pool.release(second)
+    finally:
+        await pool.close()
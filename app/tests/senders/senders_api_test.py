@@ -1,16 +1,26 @@
-from uuid import uuid4
+import asyncio
+from time import time
+from uuid import UUID, uuid4
 
 import asyncpg
 import pytest
 from fastapi import status
+from fastapi import FastAPI
 from pydantic import EmailStr
 
-from app.projects.models import Project
+from app.db import Database, get_read_db_pool
+from app.projects.models import ApiKeyCreated, Project
 from app.projects.queries import insert_project
-from app.senders.models import EmailConfIn, EmailConfInDb
-from app.senders.queries import get_email_conf, insert_email_conf
+from app.senders.models import (EmailConfIn, EmailConfInDb, EmailStatus,
+                                Message, MessageStatus)
+from app.senders.queries import (get_email_conf, get_message,
+                                 get_statuses_for_message, insert_email_conf,
+                                 insert_message, insert_statuses)
 from app.tests.conftest import AuthClient
 from app.users.models import User
+# The app serves the router of senders.api the way main.py imports it,
+# which is not the same module object as app.senders.api
+from senders import api as served_senders_api
 
 
 @pytest.mark.anyio
@@ -62,3 +72,454 @@ async def test_list_confs(
     assert response.status_code == status.HTTP_200_OK
 
     assert [EmailConfInDb(**s) for s in response.json()] == [email_conf]
+
+
+async def insert_dead_message(conn: asyncpg.Connection, project: Project) -> Message:
+    message = Message(
+        uuid=uuid4(),
+        project_uuid=project.uuid,
+        title="title",
+        text="text",
+        sync=False,
+        scheduled_ts=int(time()),
+        status=MessageStatus.dead,
+        attempts=10,
+    )
+    await insert_message(conn, message)
+    return message
+
+
+@pytest.mark.anyio
+async def test_dead_messages(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    message = await insert_dead_message(db_conn, project)
+
+    response = await auth_client.get(
+        f"/senders/dead/?project_uuid={project.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert [Message(**m) for m in response.json()] == [message]
+
+
+@pytest.mark.anyio
+async def test_requeue_dead_message(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    message = await insert_dead_message(db_conn, project)
+    email_conf = EmailConfInDb(
+        email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(db_conn, email_conf)
+    dead_status = EmailStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.dead,
+        scheduled_ts=message.scheduled_ts,
+        attempts=10,
+        email_conf_uuid=email_conf.uuid,
+        created_ts=message.created_ts,
+    )
+    await insert_statuses(db_conn, [dead_status])
+
+    response = await auth_client.post(
+        f"/senders/dead/requeue/?message_uuid={message.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.scheduled
+    (status_db,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert status_db.status == MessageStatus.scheduled
+    assert status_db.attempts == 0
+
+    response = await auth_client.post(
+        f"/senders/dead/requeue/?message_uuid={message.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["reason"] == "message_not_dead"
+
+
+@pytest.mark.anyio
+async def test_send_sync_deadline_fallback(
+    auth_client: AuthClient,
+    user: User,
+    db_conn: asyncpg.Connection,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    fast_conf = EmailConfInDb(
+        email=EmailStr("fast@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    slow_conf = EmailConfInDb(
+        email=EmailStr("slow@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(db_conn, fast_conf)
+    await insert_email_conf(db_conn, slow_conf)
+
+    async def send_to_conf(conf, message):
+        if conf.uuid == slow_conf.uuid:
+            await asyncio.sleep(10)
+
+    monkeypatch.setattr(served_senders_api, "send_to_conf", send_to_conf)
+
+    response = await auth_client.post(
+        "/senders/send/",
+        user=user,
+        json={
+            "project_uuid": str(project.uuid),
+            "title": "title",
+            "text": "text",
+            "sync": True,
+            "sync_timeout": 0.1,
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    message = Message(**response.json())
+    assert message.status == MessageStatus.scheduled
+
+    statuses = {
+        s.email_conf_uuid: s
+        for s in await get_statuses_for_message(db_conn, message.uuid)
+        if isinstance(s, EmailStatus)
+    }
+    assert statuses[fast_conf.uuid].status == MessageStatus.sent
+    assert statuses[slow_conf.uuid].status == MessageStatus.scheduled
+    assert statuses[slow_conf.uuid].attempts == 1
+    assert statuses[slow_conf.uuid].last_error is not None
+    # Retried by the worker after a backoff, not right away
+    assert statuses[slow_conf.uuid].scheduled_ts > message.scheduled_ts
+
+
+@pytest.mark.anyio
+async def test_send_batch(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    email_conf = EmailConfInDb(
+        email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(db_conn, email_conf)
+    forbidden_project = uuid4()
+
+    response = await auth_client.post(
+        "/senders/send/batch/",
+        user=user,
+        json=[
+            {
+                "project_uuid": str(project.uuid),
+                "title": "first",
+                "text": "text",
+                "sync": False,
+            },
+            {
+                "project_uuid": str(forbidden_project),
+                "title": "forbidden",
+                "text": "text",
+                "sync": False,
+            },
+            {
+                "project_uuid": str(project.uuid),
+                "title": "second",
+                "text": "text",
+                "sync": True,
+            },
+        ],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    first, forbidden, second = response.json()
+
+    assert forbidden["message"] is None
+    assert forbidden["error"]["reason"] == "not_enough_project_permissions"
+
+    for item, title in ((first, "first"), (second, "second")):
+        assert item["error"] is None
+        message = Message(**item["message"])
+        assert message.title == title
+        assert message.status == MessageStatus.scheduled
+
+        message_db = await get_message(db_conn, message.uuid)
+        assert message_db is not None
+        assert message_db.title == title
+        (status_db,) = await get_statuses_for_message(db_conn, message.uuid)
+        assert isinstance(status_db, EmailStatus)
+        assert status_db.email_conf_uuid == email_conf.uuid
+        assert status_db.status == MessageStatus.scheduled
+
+
+@pytest.mark.anyio
+async def test_send_idempotency_key(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    body = {
+        "project_uuid": str(project.uuid),
+        "title": "title",
+        "text": "text",
+        "sync": False,
+    }
+    headers = {"Idempotency-Key": str(uuid4())}
+
+    response = await auth_client.post(
+        "/senders/send/", user=user, json=body, headers=dict(headers)
+    )
+    assert response.status_code == status.HTTP_200_OK
+    message = Message(**response.json())
+
+    # Served from the in-process cache
+    response = await auth_client.post(
+        "/senders/send/", user=user, json=body, headers=dict(headers)
+    )
+    assert Message(**response.json()).uuid == message.uuid
+
+    # Served from the database
+    served_senders_api.sent_messages.clear()
+    response = await auth_client.post(
+        "/senders/send/", user=user, json=body, headers=dict(headers)
+    )
+    assert Message(**response.json()).uuid == message.uuid
+
+    count = await db_conn.fetchval(
+        "SELECT count(*) FROM messages WHERE project_uuid = $1", project.uuid
+    )
+    assert count == 1
+
+
+@pytest.mark.anyio
+async def test_send_sync_idempotency_key_reserved(
+    auth_client: AuthClient,
+    user: User,
+    db_conn: asyncpg.Connection,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    await insert_email_conf(
+        db_conn,
+        EmailConfInDb(
+            email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+        ),
+    )
+    body = {
+        "project_uuid": str(project.uuid),
+        "title": "title",
+        "text": "text",
+        "sync": True,
+    }
+    headers = {"Idempotency-Key": str(uuid4())}
+    sent: list[UUID] = []
+    retries: list[Message] = []
+
+    async def send_to_conf(conf, message):
+        sent.append(message.uuid)
+        # The client gives up and retries while the first send is running
+        response = await auth_client.post(
+            "/senders/send/", user=user, json=body, headers=dict(headers)
+        )
+        retries.append(Message(**response.json()))
+
+    monkeypatch.setattr(served_senders_api, "send_to_conf", send_to_conf)
+
+    response = await auth_client.post(
+        "/senders/send/", user=user, json=body, headers=dict(headers)
+    )
+    assert response.status_code == status.HTTP_200_OK
+    message = Message(**response.json())
+    assert message.status == MessageStatus.sent
+
+    assert sent == [message.uuid]
+    (retry,) = retries
+    assert retry.uuid == message.uuid
+    assert retry.status == MessageStatus.scheduled
+
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.sent
+
+
+@pytest.mark.anyio
+async def test_send_uses_new_conf(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    message = {
+        "project_uuid": str(project.uuid),
+        "title": "title",
+        "text": "text",
+        "sync": False,
+    }
+
+    # Caches the project with no confs
+    response = await auth_client.post("/senders/send/", user=user, json=message)
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await auth_client.post(
+        "/senders/email/",
+        user=user,
+        json={"email": "test@test.ru", "project_uuid": str(project.uuid)},
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await auth_client.post("/senders/send/", user=user, json=message)
+    assert response.status_code == status.HTTP_200_OK
+    statuses = await get_statuses_for_message(db_conn, Message(**response.json()).uuid)
+    assert len(statuses) == 1
+
+
+@pytest.mark.anyio
+async def test_send_with_api_key(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    response = await auth_client.post(
+        "/projects/keys/",
+        user=user,
+        json={"project_uuid": str(project.uuid), "name": "service"},
+    )
+    api_key = ApiKeyCreated(**response.json())
+    message = {
+        "project_uuid": str(project.uuid),
+        "title": "title",
+        "text": "text",
+        "sync": False,
+    }
+
+    response = await auth_client.post(
+        "/senders/send/", json=message, headers={"X-API-Key": api_key.key}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    other_project = {**message, "project_uuid": str(uuid4())}
+    response = await auth_client.post(
+        "/senders/send/", json=other_project, headers={"X-API-Key": api_key.key}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    await auth_client.post(f"/projects/keys/revoke/?key_uuid={api_key.uuid}", user=user)
+    response = await auth_client.post(
+        "/senders/send/", json=message, headers={"X-API-Key": api_key.key}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.anyio
+async def test_stream_message_done(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    message = await insert_dead_message(db_conn, project)
+
+    response = await auth_client.get(
+        f"/senders/message/stream/?message_uuid={message.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    # A finished message is sent once and the stream ends
+    events = [e for e in response.text.split("\n\n") if e]
+    assert len(events) == 1
+    assert events[0].startswith("event: message\ndata: ")
+    assert f'"uuid": "{message.uuid}"' in events[0]
+
+
+@pytest.mark.anyio
+async def test_list_messages_pages(
+    auth_client: AuthClient, user: User, db_conn: asyncpg.Connection
+):
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    messages = []
+    for i in range(5):
+        message = Message(
+            uuid=uuid4(),
+            project_uuid=project.uuid,
+            title="title",
+            text="text",
+            sync=False,
+            scheduled_ts=1000 + i,
+            status=MessageStatus.sent if i % 2 else MessageStatus.scheduled,
+        )
+        await insert_message(db_conn, message)
+        messages.append(message)
+
+    seen = []
+    cursor = None
+    while True:
+        url = f"/senders/messages/?project_uuid={project.uuid}&limit=2"
+        if cursor is not None:
+            url += f"&cursor={cursor}"
+        response = await auth_client.get(url, user=user)
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        seen.extend(Message(**m) for m in page["messages"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == messages[::-1]
+
+    response = await auth_client.get(
+        f"/senders/messages/?project_uuid={project.uuid}&status=sent"
+        "&with_statuses=true",
+        user=user,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    page = response.json()
+    assert [Message(**m) for m in page["messages"]] == [messages[3], messages[1]]
+    assert page["statuses"] == []
+
+
+@pytest.mark.anyio
+async def test_message_read_from_lagging_replica(
+    app: FastAPI,
+    auth_client: AuthClient,
+    user: User,
+    db: Database,
+    db_conn: asyncpg.Connection,
+):
+    # Other connections don't see the test transaction, like a replica
+    # that has not caught up with it
+    app.dependency_overrides[get_read_db_pool] = lambda: db.pool
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(db_conn, project, user)
+    email_conf = EmailConfInDb(
+        email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(db_conn, email_conf)
+
+    response = await auth_client.get(
+        f"/senders/?project_uuid={project.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    # Read from the primary like the access, not the lagging replica
+    assert [EmailConfInDb(**s) for s in response.json()] == [email_conf]
+
+    response = await auth_client.post(
+        "/senders/send/",
+        user=user,
+        json={
+            "project_uuid": str(project.uuid),
+            "title": "title",
+            "text": "text",
+            "sync": False,
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    message = Message(**response.json())
+
+    response = await auth_client.get(
+        f"/senders/message/?message_uuid={message.uuid}", user=user
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert Message(**response.json()["message"]) == message
@@ -0,0 +1,249 @@
+from time import time
+from uuid import uuid4
+
+import asyncpg
+import pytest
+from pydantic import EmailStr
+
+from app.projects.models import Project
+from app.projects.queries import insert_project
+from app.senders.models import (
+    Channel,
+    EmailConfInDb,
+    EmailStatus,
+    Message,
+    MessageStatus,
+    TelegramConfInDb,
+    TelegramStatus,
+)
+from app.senders.queries import (
+    claim_deliveries,
+    finalize_messages,
+    get_message,
+    get_next_scheduled_ts,
+    get_statuses_for_message,
+    insert_email_conf,
+    insert_message,
+    insert_statuses,
+    insert_telegram_conf,
+    release_statuses,
+)
+from app.users.models import UserInDB
+from app.users.queries import insert_user
+
+
+async def create_project(conn: asyncpg.Connection) -> Project:
+    user = UserInDB(username="test", password_hash="test", uuid=uuid4())
+    await insert_user(conn, user)
+    project = Project(name="project", description="", uuid=uuid4())
+    await insert_project(conn, project, user)
+    return project
+
+
+def make_message(project: Project, **kwargs) -> Message:
+    fields = dict(
+        uuid=uuid4(),
+        project_uuid=project.uuid,
+        title="title",
+        text="text",
+        sync=False,
+        scheduled_ts=int(time()),
+        status=MessageStatus.scheduled,
+    )
+    fields.update(kwargs)
+    return Message(**fields)
+
+
+async def create_email_conf(
+    conn: asyncpg.Connection, project: Project
+) -> EmailConfInDb:
+    conf = EmailConfInDb(
+        email=EmailStr("test@test.ru"), project_uuid=project.uuid, uuid=uuid4()
+    )
+    await insert_email_conf(conn, conf)
+    return conf
+
+
+async def create_email_status(
+    conn: asyncpg.Connection, message: Message, conf: EmailConfInDb, **kwargs
+) -> EmailStatus:
+    fields = dict(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=message.status,
+        scheduled_ts=message.scheduled_ts,
+        email_conf_uuid=conf.uuid,
+        created_ts=message.created_ts,
+    )
+    fields.update(kwargs)
+    status = EmailStatus(**fields)
+    await insert_statuses(conn, [status])
+    return status
+
+
+@pytest.mark.anyio
+async def test_claim_deliveries(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    telegram_conf = TelegramConfInDb(chat_id=1, project_uuid=project.uuid, uuid=uuid4())
+    await insert_telegram_conf(db_conn, telegram_conf)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+
+    # Deliveries of all channels are claimed in scheduled_ts order
+    due = await create_email_status(
+        db_conn, message, email_conf, scheduled_ts=message.scheduled_ts - 1
+    )
+    await create_email_status(
+        db_conn, message, email_conf, scheduled_ts=int(time()) + 1000
+    )
+    await create_email_status(db_conn, message, email_conf, status=MessageStatus.sent)
+    telegram = TelegramStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.scheduled,
+        scheduled_ts=message.scheduled_ts,
+        telegram_conf_uuid=telegram_conf.uuid,
+        created_ts=message.created_ts,
+    )
+    await insert_statuses(db_conn, [telegram])
+
+    claimed = await claim_deliveries(db_conn, "worker-1", 60)
+    assert claimed == [(due, email_conf), (telegram, telegram_conf)]
+
+    assert await claim_deliveries(db_conn, "worker-2", 60) == []
+
+
+@pytest.mark.anyio
+async def test_claim_deliveries_channels(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    telegram_conf = TelegramConfInDb(chat_id=1, project_uuid=project.uuid, uuid=uuid4())
+    await insert_telegram_conf(db_conn, telegram_conf)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+    await create_email_status(db_conn, message, email_conf)
+    telegram = TelegramStatus(
+        uuid=uuid4(),
+        message_uuid=message.uuid,
+        status=MessageStatus.scheduled,
+        scheduled_ts=message.scheduled_ts,
+        telegram_conf_uuid=telegram_conf.uuid,
+        created_ts=message.created_ts,
+    )
+    await insert_statuses(db_conn, [telegram])
+
+    # Email is left alone for when its channel is let through again
+    claimed = await claim_deliveries(
+        db_conn, "worker-1", 60, channels=[Channel.telegram]
+    )
+    assert claimed == [(telegram, telegram_conf)]
+
+
+@pytest.mark.anyio
+async def test_claim_deliveries_deleted_conf(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+    status = await create_email_status(db_conn, message, email_conf)
+
+    # Deleting a conf takes its deliveries along
+    await db_conn.execute("DELETE FROM email_conf WHERE uuid = $1", email_conf.uuid)
+    assert await get_statuses_for_message(db_conn, message.uuid) == []
+
+    # One slipping in after the delete is dead, not a crash of the worker
+    await insert_statuses(db_conn, [status])
+    assert await claim_deliveries(db_conn, "worker-1", 60) == []
+    (dead,) = await get_statuses_for_message(db_conn, message.uuid)
+    assert dead.status == MessageStatus.dead
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.dead
+
+
+@pytest.mark.anyio
+async def test_claim_deliveries_expired_lease(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+    status = await create_email_status(db_conn, message, email_conf)
+
+    assert len(await claim_deliveries(db_conn, "worker-1", -1)) == 1
+
+    claimed = await claim_deliveries(db_conn, "worker-2", 60)
+    assert claimed == [(status, email_conf)]
+
+
+@pytest.mark.anyio
+async def test_release_and_finalize(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+    await create_email_status(db_conn, message, email_conf)
+    await create_email_status(db_conn, message, email_conf)
+
+    (first, _), (second, _) = await claim_deliveries(db_conn, "worker-1", 60)
+
+    first.status = MessageStatus.sent
+    second.scheduled_ts = int(time()) + 100
+    second.attempts = 1
+    second.last_error = "error"
+    # Lease is owned by another worker, nothing is written
+    await release_statuses(db_conn, [first, second], "worker-2")
+    statuses = await get_statuses_for_message(db_conn, message.uuid)
+    assert {s.status for s in statuses} == {MessageStatus.scheduled}
+
+    await release_statuses(db_conn, [first, second], "worker-1")
+    await finalize_messages(db_conn, [(message.uuid, message.created_ts)])
+    statuses = {
+        s.uuid: s for s in await get_statuses_for_message(db_conn, message.uuid)
+    }
+    assert statuses[first.uuid].status == MessageStatus.sent
+    assert statuses[second.uuid] == second
+    message_db = await get_message(db_conn, message.uuid)
+    assert message_db is not None
+    assert message_db.status == MessageStatus.scheduled
+
+
+@pytest.mark.anyio
+async def test_finalize_messages(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    sent = make_message(project)
+    dead = make_message(project)
+    for message in (sent, dead):
+        await insert_message(db_conn, message)
+        await create_email_status(
+            db_conn, message, email_conf, status=MessageStatus.sent
+        )
+    await create_email_status(db_conn, dead, email_conf, status=MessageStatus.dead)
+
+    await finalize_messages(
+        db_conn, [(sent.uuid, sent.created_ts), (dead.uuid, dead.created_ts)]
+    )
+
+    sent_db = await get_message(db_conn, sent.uuid)
+    dead_db = await get_message(db_conn, dead.uuid)
+    assert sent_db is not None and sent_db.status == MessageStatus.sent
+    assert dead_db is not None and dead_db.status == MessageStatus.dead
+
+
+@pytest.mark.anyio
+async def test_get_next_scheduled_ts(db_conn: asyncpg.Connection):
+    project = await create_project(db_conn)
+    email_conf = await create_email_conf(db_conn, project)
+    message = make_message(project)
+    await insert_message(db_conn, message)
+    now = int(time())
+    for scheduled_ts in (now - 10, now + 100, now + 50):
+        await create_email_status(
+            db_conn, message, email_conf, scheduled_ts=scheduled_ts
+        )
+    await create_email_status(
+        db_conn, message, email_conf, scheduled_ts=now + 10, status=MessageStatus.sent
+    )
+
+    assert await get_next_scheduled_ts(db_conn) == now + 50
@@ -0,0 +1,18 @@
+from uuid import uuid4
+
+from app.senders.stream import StatusHub
+
+
+def test_status_hub_wakes_subscribers_of_message():
+    hub = StatusHub()
+    message_uuid = uuid4()
+
+    with hub.subscribe(message_uuid) as changed, hub.subscribe(uuid4()) as other:
+        hub.on_notify(str(message_uuid))
+        assert changed.is_set()
+        assert not other.is_set()
+
+        hub.wake_all()
+        assert other.is_set()
+
+    assert hub.subscribers == {}
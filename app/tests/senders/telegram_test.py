@@ -0,0 +1,117 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from app.senders.telegram import TelegramSender, TokenBucket
+
+
+class FakeBot:
+    """
+    Answers the first floods[chat_id] sends to a chat with a flood error
+    asking to wait retry_after seconds, takes delay seconds per request.
+    """
+
+    def __init__(
+        self,
+        floods: dict[int, int] | None = None,
+        retry_after: int = 1,
+        delay: float = 0,
+    ):
+        self.floods = dict(floods or {})
+        self.retry_after = retry_after
+        self.delay = delay
+        self.sent: list[int] = []
+        self.flooded: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str):
+        await asyncio.sleep(self.delay)
+        if self.floods.get(chat_id):
+            self.floods[chat_id] -= 1
+            self.flooded.append(chat_id)
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text),
+                message="Flood control exceeded",
+                retry_after=self.retry_after,
+            )
+        self.sent.append(chat_id)
+
+
+def make_sender(bot: FakeBot, chat_rate: float = 100, max_retries: int = 3):
+    return TelegramSender(
+        bot,  # type: ignore[arg-type]
+        global_rate=100,
+        chat_rate=chat_rate,
+        concurrency=10,
+        max_retries=max_retries,
+    )
+
+
+@pytest.mark.anyio
+async def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    start = monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+
+    # Two tokens from the burst, two more at 20/s
+    assert 0.08 <= monotonic() - start < 0.5
+
+
+@pytest.mark.anyio
+async def test_token_bucket_pause():
+    bucket = TokenBucket(rate=100, capacity=1)
+    bucket.pause(0.1)
+    assert not bucket.is_idle()
+
+    start = monotonic()
+    await bucket.acquire()
+    assert monotonic() - start >= 0.09
+
+
+@pytest.mark.anyio
+async def test_telegram_sender_timeout_excludes_throttling():
+    bot = FakeBot(delay=0.01)
+    sender = make_sender(bot, chat_rate=20)
+
+    # The burst to one chat is spread over 0.15s by its rate limit, which
+    # is not held against the per request timeout
+    await asyncio.gather(*[sender.send(1, "text", timeout=0.05) for _ in range(4)])
+    assert bot.sent == [1] * 4
+
+    slow = make_sender(FakeBot(delay=0.2))
+    with pytest.raises(asyncio.TimeoutError):
+        await slow.send(1, "text", timeout=0.05)
+
+
+@pytest.mark.anyio
+async def test_telegram_sender_flood_pauses_only_its_chat():
+    bot = FakeBot(floods={1: 1})
+    sender = make_sender(bot)
+
+    start = monotonic()
+    flooded = asyncio.create_task(sender.send(1, "text"))
+    await asyncio.sleep(0.01)
+    await sender.send(2, "text")
+    assert monotonic() - start < 0.5
+    assert not flooded.done()
+
+    await flooded
+    assert monotonic() - start >= 0.9
+    assert bot.flooded == [1]
+    assert bot.sent == [2, 1]
+    assert sender.global_bucket.paused_until == 0
+
+
+@pytest.mark.anyio
+async def test_telegram_sender_max_retries():
+    bot = FakeBot(floods={1: 10}, retry_after=0)
+    sender = make_sender(bot, max_retries=2)
+
+    with pytest.raises(TelegramRetryAfter):
+        await sender.send(1, "text")
+    # The first try and two retries
+    assert bot.flooded == [1, 1, 1]
+    assert bot.sent == []